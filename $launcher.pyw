@@ -1,4 +1,5 @@
 import builtins
+import multiprocessing
 import os, traceback
 
 logfiles = True
@@ -30,4 +31,7 @@ def main():
         builtins.print = cprint
 
 if __name__ == "__main__":
+    # Frozen builds start the off-screen simulation workers (see offscreen)
+    # by running the executable again, this takes them over
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -1,45 +1,173 @@
 import abc
-import time
 
 print("Load abstract base class of level")
 
+def sprite_factions(sprite):
+    result = []
+    if sprite.hostile:
+        result.append("hostile")
+    if sprite.friendly:
+        result.append("friendly")
+    if not result:
+        result.append("passive")
+    return result
+
 class SpriteContainer(list):
+    factions = ("hostile", "friendly", "passive")
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.setchange()
+        # Incremented on every change, so that anything derived
+        # from the contents can tell if it is out of date
+        self.version = 0
+        # Membership is tracked next to the list so that tests are O(1).
+        # Dicts are used as ordered sets (sprite -> None).
+        self.counts = {}
+        self.by_faction = {faction: {} for faction in self.factions}
+        self.faction_versions = {faction: 0 for faction in self.factions}
+        self.by_class = {}
+        self._faction_lists = {faction: (-1, []) for faction in self.factions}
+        # Indexes (e.g. a spatial hash) that are kept in sync with the contents,
+        # they should provide add, discard and clear methods.
+        self.indexes = []
+        # While changes are deferred (e.g. during a level tick, so that sprites
+        # may remove themselves), the list itself is left untouched and the
+        # changes are applied at once by apply_changes. Membership, partitions
+        # and indexes are still updated right away.
+        self.deferred = False
+        self.pending_added = []
+        self.pending_removed = {}
+        for sprite in self:
+            self._indexed(sprite)
+
+    def __contains__(self, sprite):
+        return sprite in self.counts
 
     def setchange(self):
-        self.last_changed = time.time()
-
-    def append(self, *args, **kwargs):
-        super().append(*args, **kwargs)
-        self.setchange()
-
-    def clear(self, *args, **kwargs):
-        super().clear(*args, **kwargs)
+        self.version += 1
+
+    def add_index(self, index):
+        for sprite in self.counts:
+            index.add(sprite)
+        self.indexes.append(index)
+
+    def get_faction(self, faction):
+        # The list is rebuilt only after a sprite of this faction was added or removed
+        version, result = self._faction_lists[faction]
+        if version != self.faction_versions[faction]:
+            result = list(self.by_faction[faction])
+            self._faction_lists[faction] = (self.faction_versions[faction], result)
+        return result
+
+    def get_class(self, cls):
+        return list(self.by_class.get(cls, ()))
+
+    def _indexed(self, sprite):
+        count = self.counts.get(sprite, 0)
+        self.counts[sprite] = count + 1
+        if count:
+            return
+        for faction in sprite_factions(sprite):
+            self.by_faction[faction][sprite] = None
+            self.faction_versions[faction] += 1
+        self.by_class.setdefault(type(sprite), {})[sprite] = None
+        for index in self.indexes:
+            index.add(sprite)
+
+    def _unindexed(self, sprite):
+        count = self.counts[sprite] - 1
+        if count:
+            self.counts[sprite] = count
+            return
+        del self.counts[sprite]
+        for faction in sprite_factions(sprite):
+            del self.by_faction[faction][sprite]
+            self.faction_versions[faction] += 1
+        same_class = self.by_class[type(sprite)]
+        del same_class[sprite]
+        if not same_class:
+            del self.by_class[type(sprite)]
+        for index in self.indexes:
+            index.discard(sprite)
+
+    def defer_changes(self):
+        self.deferred = True
+
+    def apply_changes(self):
+        self.deferred = False
+        if self.pending_removed:
+            # Compact in-place in a single pass
+            removed = self.pending_removed
+            alive = 0
+            for sprite in list.__iter__(self):
+                count = removed.get(sprite)
+                if count:
+                    removed[sprite] = count - 1
+                    continue
+                self[alive] = sprite
+                alive += 1
+            del self[alive:]
+            removed.clear()
+        if self.pending_added:
+            super().extend(self.pending_added)
+            self.pending_added.clear()
+
+    def append(self, sprite):
+        if self.deferred:
+            self.pending_added.append(sprite)
+        else:
+            super().append(sprite)
+        self._indexed(sprite)
         self.setchange()
 
-    def extend(self, *args, **kwargs):
-        super().extend(*args, **kwargs)
+    def clear(self):
+        super().clear()
+        self.pending_added.clear()
+        self.pending_removed.clear()
+        self.counts.clear()
+        for faction in self.factions:
+            self.by_faction[faction].clear()
+            self.faction_versions[faction] += 1
+        self.by_class.clear()
+        for index in self.indexes:
+            index.clear()
         self.setchange()
 
-    def insert(self, *args, **kwargs):
-        super().insert(*args, **kwargs)
+    def extend(self, sprites):
+        for sprite in sprites:
+            self.append(sprite)
+
+    def insert(self, index, sprite):
+        if self.deferred:
+            # The position is lost, the sprite is added at the end
+            self.pending_added.append(sprite)
+        else:
+            super().insert(index, sprite)
+        self._indexed(sprite)
         self.setchange()
 
     def pop(self, *args, **kwargs):
+        if self.deferred:
+            raise RuntimeError("Cannot pop from a SpriteContainer while changes are deferred")
         try:
-            super().pop(*args, **kwargs)
+            sprite = super().pop(*args, **kwargs)
+            self._unindexed(sprite)
             self.setchange()
+            return sprite
         except IndexError as e:
             print("Unhandled IndexError in SpriteContainer: {}".format(str(e)))
 
-    def remove(self, *args, **kwargs):
-        try:
-            super().remove(*args, **kwargs)
-            self.setchange()
-        except ValueError as e:
-            print("Unhandled ValueError in SpriteContainer: {}".format(str(e)))
+    def remove(self, sprite):
+        if sprite not in self.counts:
+            print("Unhandled ValueError in SpriteContainer: list.remove(x): x not in list")
+            return
+        if not self.deferred:
+            super().remove(sprite)
+        elif sprite in self.pending_added:
+            self.pending_added.remove(sprite)
+        else:
+            self.pending_removed[sprite] = self.pending_removed.get(sprite, 0) + 1
+        self._unindexed(sprite)
+        self.setchange()
 
 class AbstractLevel(metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -51,9 +179,6 @@ class AbstractLevel(metaclass=abc.ABCMeta):
         self.sprites = SpriteContainer()
         self.particles = []
         self.layout = self.get_layout_copy()
-        self._hostile_sprites = []; self._hcheck = self.sprites.last_changed
-        self._friendly_sprites = []; self._fcheck = self.sprites.last_changed
-        self._passive_sprites = []; self._pcheck = self.sprites.last_changed
 
     @abc.abstractmethod
     def get_layout_copy(self):
@@ -116,22 +241,12 @@ class AbstractLevel(metaclass=abc.ABCMeta):
 
     @property
     def hostile_sprites(self):
-        if self.sprites.last_changed != self._hcheck:
-            self._hostile_sprites = [sprite for sprite in self.sprites if sprite.hostile]
-            self._hcheck = self.sprites.last_changed
-        return self._hostile_sprites
+        return self.sprites.get_faction("hostile")
 
     @property
     def friendly_sprites(self):
-        if self.sprites.last_changed != self._fcheck:
-            self._friendly_sprites = [sprite for sprite in self.sprites if sprite.friendly]
-            self._fcheck = self.sprites.last_changed
-        return self._friendly_sprites
+        return self.sprites.get_faction("friendly")
 
     @property
     def passive_sprites(self):
-        if self.sprites.last_changed != self._pcheck:
-            self._passive_sprites = [sprite for sprite in self.sprites 
-                                     if sprite.hostile is sprite.friendly is False]
-            self._pcheck = self.sprites.last_changed
-        return self._passive_sprites
\ No newline at end of file
+        return self.sprites.get_faction("passive")
\ No newline at end of file
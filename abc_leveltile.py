@@ -10,8 +10,13 @@ tile_size = config["tile_size"]
 tile_size_t = (tile_size, tile_size)
 
 class AbstractLevelTile(metaclass=abc.ABCMeta):
+    # Tiles that need updates are subscribed to the level's
+    # active tiles when it is created, and may unsubscribe later
     needs_update = None
     passable = None
+    # Everything that changes the appearance of the tile. Levels
+    # with equal render states share their renders (see levels.render_cache)
+    render_state = None
     @abc.abstractmethod
     def __init__(self, level, col_idx, row_idx):
         """
@@ -23,9 +28,16 @@ class AbstractLevelTile(metaclass=abc.ABCMeta):
 
     def update(self):
         """
-        Update this tile. Called every tick.
+        Update this tile. Called every tick
+        while the tile is subscribed to the level.
         """
 
+    def subscribe(self):
+        self.level.subscribe_tile(self)
+
+    def unsubscribe(self):
+        self.level.unsubscribe_tile(self)
+
     @property
     @abc.abstractmethod
     def surface(self):
@@ -80,4 +80,11 @@ class AbstractGameState(metaclass=abc.ABCMeta):
         Draw this state to screen. Do not update the screen
         through here. Return a list of rectangles (selective update)
         or None (complete update).
+        """
+
+    def invalidate_rect(self, rect):
+        """
+        Called after something was drawn over this state outside
+        of draw (e.g. the console), if the last draw returned
+        a list of rectangles. The state should draw over it again.
         """
\ No newline at end of file
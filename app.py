@@ -89,7 +89,7 @@ import gameconsole
 # These are imported to be used by the console
 # They were already imported before by children modules so there's almost no overhead
 import states, leveltiles, enemies, playeritems, projectiles
-import imglib, fontutils, utils, particles, pathfinding
+import imglib, fontutils, utils, particles, pathfinding, raycast
 
 # Runtime utilities
 class AutoProfile:
@@ -149,6 +149,10 @@ dungeon_dbg_template = """\
 sprites: {s} (f: {f} | h: {h} | p: {p})
 particles: {pc}
 pos: {x}, {y} (center: {xc}, {yc}) (idx: {xi}, {yi})
+redrawn tiles: {rt} (total: {rtt})
+dirty rects: {dr} (F7)
+path queue: {pq} (done: {pd}, last run: {pt}μs, overruns: {po})
+thinking: {th} (sleeping: {sl})
 """
 
 class App:
@@ -217,7 +221,7 @@ class App:
             lvl = get_level()
             lvl.sprites.append(playeritems.DroppedItem(lvl, pos, item_cls))
         def get_sprites_by_class(cls):
-            return get_level().get_sprites_if(lambda sprite: type(sprite) is cls)
+            return get_level().sprites.get_class(cls)
         def get_sprite_by_class(cls):
             return get_sprites_by_class(cls)[0]
         def give(arg):
@@ -324,6 +328,9 @@ class App:
             autocall(set_max_hp)
         def noclip():
             get_player().noclip = not get_player().noclip
+        def toggle_dirty_rects():
+            self.game.vars["dirty_rects"] = not self.game.vars["dirty_rects"]
+            print("Dirty rects:", "on" if self.game.vars["dirty_rects"] else "off")
 
         # Main loop
         pause = False
@@ -350,6 +357,9 @@ class App:
                         show_dbg = not show_dbg
                         if show_dbg: force_show_dbg = True
                         minim_dbg = alt_pressed(pressed_keys)
+                    elif event.key == controls.DebugKeys.ToggleDirtyRects and show_dbg:
+                        toggle_dirty_rects()
+                        force_show_dbg = True
                     elif event.key == controls.DebugKeys.ToggleMouse:
                         if not current_state.use_mouse:
                             self.game.vars["forced_mouse"] = not self.game.vars["forced_mouse"]
@@ -428,7 +438,8 @@ class App:
                 profile = AutoProfile("drawprofile")
                 profile.start()
             with TimeKeeper(draw_time):
-                self.game.draw(current_state, self.screen)
+                # A list of rects to update on the display, or None for all of it
+                update_rects = self.game.draw(current_state, self.screen)
             if self.profile_draw_tick:
                 profile.stop()
                 del profile
@@ -447,6 +458,9 @@ class App:
                     namespace.update(self.console_namespace_additions)
                     self.console.interpret_current(namespace)
                 self.console.draw(self.screen)
+                if update_rects is not None:
+                    current_state.invalidate_rect(self.console.rect)
+                    update_rects.append(self.console.rect)
 
             if show_dbg:
                 # Pathfinding tests
@@ -459,16 +473,31 @@ class App:
                     layout = current_state.level.layout
                     if pressed_keys[pygame.K_1]:
                         t = pygame.Surface((tile, tile)).convert_alpha()
-                        t.fill((255, 255, 255, 150))
-                        for col, row in pathfinding.get_path_npoints(a1, a2):
+                        if current_state.level.los_cache.get(a1, a2):
+                            t.fill((255, 255, 255, 150))
+                        else:
+                            t.fill((255, 0, 0, 150))
+                        passable = current_state.level.passable_grid
+                        # Line of sight, up to the first blocking tile
+                        for col, row in raycast.tile_ray_tiles(a1, a2):
+                            if not passable.inside(col, row):
+                                break
                             r = layout[row][col].rect.move(levelfix)
                             self.screen.blit(t, r)
+                            if update_rects is not None:
+                                current_state.invalidate_rect(r)
+                                update_rects.append(r)
+                            if not passable.get(col, row):
+                                break
                     if pressed_keys[pygame.K_2]:
                         t = pygame.Surface((tile, tile)).convert_alpha()
                         t.fill((0, 255, 0, 150))
-                        for col, row in pathfinding.a_star_in_level(a1, a2, layout):
+                        for col, row in current_state.level.get_path_grid().find_path(a1, a2):
                             r = layout[row][col].rect.move(levelfix)
                             self.screen.blit(t, r)
+                            if update_rects is not None:
+                                current_state.invalidate_rect(r)
+                                update_rects.append(r)
                 if not self.game.gticks % 15 or force_show_dbg:
                     dbg_text = ""
                     if not self.game.gticks % 30 or force_show_dbg:
@@ -486,8 +515,15 @@ class App:
                                 _pc = len(_lvl.particles); _x, _y = get_player().rect.topleft;
                                 _xc, _yc = get_player().rect.center
                                 _xi, _yi = get_player().closest_tile_index
+                                _rt, _rtt = _lvl.redrawn_tiles_count, _lvl.redrawn_tiles_total
+                                _dr = current_state.dirty_rects_count if self.game.vars["dirty_rects"] else "off"
+                                _pq = _lvl.path_requests
                                 dbg_text += dungeon_dbg_template.format(s=_s, f=_f, h=_h, p=_p, pc=_pc,
-                                                                        x=_x, y=_y, xc=_xc, yc=_yc, xi=_xi, yi=_yi)
+                                                                        x=_x, y=_y, xc=_xc, yc=_yc, xi=_xi, yi=_yi,
+                                                                        rt=_rt, rtt=_rtt, dr=_dr,
+                                                                        pq=len(_pq), pd=_pq.completed,
+                                                                        pt=_pq.last_run_time, po=_pq.overruns,
+                                                                        th=_lvl.scheduler.thinking, sl=_lvl.scheduler.sleeping)
                         if self.recording:
                             dbg_text += "(REC)\n"
                     else:
@@ -505,6 +541,9 @@ class App:
                     dbg_text_rect.topleft = p
                     force_show_dbg = False
                 self.screen.blit(render, dbg_text_rect)
+                if update_rects is not None:
+                    current_state.invalidate_rect(dbg_text_rect)
+                    update_rects.append(dbg_text_rect)
 
             with TimeKeeper(screenupdate_time):
                 if self.enable_autoscale:
@@ -512,7 +551,11 @@ class App:
                     scaled = imglib.scale(self.screen, self._screen.get_size(),
                                           docache=False, dolog=False)
                     self._screen.blit(scaled, (0, 0))
-                pygame.display.flip()
+                    pygame.display.flip()
+                elif update_rects is None:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(update_rects)
             self.total_screenupdate_time += screenupdate_time.value
 
             if self.recording:
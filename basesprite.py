@@ -3,6 +3,7 @@ import uuid
 import pygame
 
 import json_ext as json
+from levelgrid import tile_rect_collides
 import spriteutils
 import utils
 
@@ -50,18 +51,11 @@ class BaseSprite:
         
     def draw(self, screen, pos_fix=(0, 0)):
         screen.blit(self.surface, self.rect.move(pos_fix))
-        nearby = self.get_tiles_next_to() + [self.closest_tile_index]
-        self.is_overdrawn = False
-        for col, row in nearby:
-            tile = self.level.layout[row][col]
-            if not tile.transparent and self.rect.colliderect(tile.rect) and \
-               (col, row) not in self.level.redrawn:
-                self.level.redrawn.add((col, row))
-                self.is_overdrawn = True
+        self.is_overdrawn = self.level.mark_overdrawn(self.rect)
 
     def handle_moving(self):
         row, col = self.closest_tile_index
-        args = (self.level.layout, self.moving, col, row, 
+        args = (self.level.passable_grid, self.moving, col, row, 
                 self.rect, self.move_speed, screen_rect, self.noclip)
         self.rect, self.collides = spriteutils.move_in_level(*args)
 
@@ -83,12 +77,13 @@ class BaseSprite:
         return self.rect.colliderect(screen_rect)
 
     def get_collision_nearby(self):
+        grid = self.level.passable_grid
+        data, width = grid.data, grid.width
         pcol, prow = self.closest_tile_index
-        if not self.level.layout[prow][pcol].passable:
+        if not data[prow * width + pcol]:
             return True
         for col, row in self.get_tiles_next_to():
-            tile = self.level.layout[row][col]
-            if not tile.passable and self.rect.colliderect(tile.rect):
+            if not data[row * width + col] and tile_rect_collides(self.rect, col, row):
                 return True
         return False
 
@@ -102,20 +97,38 @@ class BaseSprite:
         self.last_attacked_sprite = sprite
 
     def simple_deal_damage(self, once=True):
-        for sprite in self.get_local_enemy_sprites():
-            if sprite.is_entity and self.rect.colliderect(sprite.rect):
-                self.deal_damage(sprite)
-                if once:
-                    return True
+        for sprite in self.get_local_enemy_sprites(self.rect):
+            self.deal_damage(sprite)
+            if once:
+                return True
         return False
 
     @staticmethod
-    def get_enemy_sprites_as(friendly, hostile, level):
-        result = level.hostile_sprites if friendly else level.friendly_sprites if hostile else []
+    def get_enemy_sprites_as(friendly, hostile, level, rect=None, *, center=None, radius=None):
+        # With a rect (or a center and a radius) given, only the enemy sprites
+        # in that area are returned, looked up in the level's spatial hash
+        faction = "hostile" if friendly else "friendly" if hostile else None
+        if faction is None:
+            result = []
+        elif rect is not None:
+            result = level.spatial_hash.query_rect(rect, faction)
+        elif radius is not None:
+            result = level.spatial_hash.query_radius(center, radius, faction)
+        else:
+            result = level.hostile_sprites if friendly else level.friendly_sprites
         result = [s for s in result if s.is_entity]
-        if level.parent is not None and hostile:
-            result.append(level.parent.player)
+        player = None if level.parent is None else level.parent.player
+        if player is not None and hostile:
+            if rect is not None:
+                if rect.colliderect(player.rect):
+                    result.append(player)
+            elif radius is not None:
+                if utils.dist(center, player.rect.center) < radius:
+                    result.append(player)
+            else:
+                result.append(player)
         return result
 
-    def get_local_enemy_sprites(self):
-        return self.get_enemy_sprites_as(self.friendly, self.hostile, self.level)
\ No newline at end of file
+    def get_local_enemy_sprites(self, rect=None, *, center=None, radius=None):
+        return self.get_enemy_sprites_as(self.friendly, self.hostile, self.level, rect,
+                                         center=center, radius=radius)
\ No newline at end of file
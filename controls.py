@@ -72,6 +72,7 @@ class DebugKeys:
     ToggleConsole = Key(pygame.K_F2)
     ToggleDebug = Key(pygame.K_F3)
     ToggleMouse = Key(pygame.K_F6)
+    ToggleDirtyRects = Key(pygame.K_F7) # only with the debug overlay on
     ToggleFullscreen = Key(pygame.K_F11)
     TakeScreenshot = Key(pygame.K_F12)
 
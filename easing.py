@@ -19,24 +19,125 @@ def ease_circular_in(time, start_value, value_increase, total_time):
     return -value_increase * (math.sqrt(1 - (time / total_time) ** 2) - 1) + start_value
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ===== Lookup tables =====
+
+# (ease, total_time) -> values of the curve from 0 to 1 at every whole time
+ease_table_cache = {}
+def get_ease_table(ease, total_time):
+    params = (ease, total_time)
+    if params not in ease_table_cache:
+        ease_table_cache[params] = [ease(time, 0, 1, total_time) for time in range(total_time + 1)]
+    return ease_table_cache[params]
+
+def ease_from_table(ease, time, start_value, value_increase, total_time):
+    # Same as ease(time, ...), looked up for whole times from 0 to total_time
+    if time.__class__ is int and 0 <= time <= total_time and ease in builtin_eases:
+        return value_increase * get_ease_table(ease, total_time)[time] + start_value
+    return ease(time, start_value, value_increase, total_time)
+
+# ===== Sums =====
+
+def _power_sum(n, power):
+    # 0 ** power + 1 ** power + ... + n ** power
+    if n <= 0:
+        return 0
+    if power == 3:
+        return (n * (n + 1) // 2) ** 2
+    if power == 5:
+        return n ** 2 * (n + 1) ** 2 * (2 * n ** 2 + 2 * n - 1) // 12
+    raise ValueError("Unsupported power: {}".format(power))
+
+# Sums of the curves from 0 to 1, over the whole times from 0 to total_time
+def _linear_sum(total_time):
+    return (total_time + 1) / 2
+
+def _in_out_cubic_sum(total_time):
+    # 4(t/T)^3 before the half, 1 - 4(1 - t/T)^3 from there on
+    half = (total_time + 1) // 2 # First time in the second half
+    cubes = _power_sum(half - 1, 3) - _power_sum(total_time - half, 3)
+    return 4 * cubes / total_time ** 3 + total_time - half + 1
+
+def _quintic_out_sum(total_time):
+    # 1 - (1 - t/T)^5
+    return total_time + 1 - _power_sum(total_time, 5) / total_time ** 5
+
+closed_form_sums = {
+    ease_linear: _linear_sum,
+    ease_in_out_cubic: _in_out_cubic_sum,
+    ease_quintic_out: _quintic_out_sum,
+}
+
+# (ease, total_time, first time, step) -> sum of the table
+ease_table_sum_cache = {}
+def ease_unit_sum(ease, total_time, first=0, step=1):
+    """
+    Sum of the curve from 0 to 1 over range(first, total_time + 1, step).
+    Closed form where there is one, otherwise a cached sum of the table.
+    Only for the easing functions of this module.
+    """
+    # All of the curves start at 0, so starting from 1 makes no difference
+    if first in (0, 1) and step == 1 and ease in closed_form_sums:
+        return closed_form_sums[ease](total_time)
+    params = (ease, total_time, first, step)
+    if params not in ease_table_sum_cache:
+        ease_table_sum_cache[params] = sum(get_ease_table(ease, total_time)[first::step])
+    return ease_table_sum_cache[params]
+
 def ease_value_sum(ease, start_value, value_increase, total_time):
+    if ease in builtin_eases:
+        return (total_time + 1) * start_value + value_increase * ease_unit_sum(ease, total_time)
     result = 0
     for time in range(total_time + 1):
-        if ease == ease_quintic_out:
-            result += max_value - value_increase * ((time / total_time - 1) ** 5 + 1) + start_value
-        else:
-            result += ease(time, start_value, value_increase, total_time)
+        result += ease(time, start_value, value_increase, total_time)
     return result
 
 def ease_value_sum_fm(ease, max_value, start_value, value_increase, total_time, app=1):
+    if ease in builtin_eases:
+        count = len(range(1, total_time + 1, app))
+        unit_sum = ease_unit_sum(ease, total_time, 1, app)
+        return (count * (max_value - start_value) - value_increase * unit_sum) * app
     result = 0
     for time in range(1, total_time + 1, app):
-        if ease == ease_quintic_out:
-            result += max_value - value_increase * ((time / total_time - 1) ** 5 + 1) + start_value
-        else:
-            result += max_value - ease(time, start_value, value_increase, total_time)
+        result += max_value - ease(time, start_value, value_increase, total_time)
     return result * app
 
+# ===== Array versions =====
+# Same as the functions above, for NumPy arrays of times (or any of the arguments)
+
+def ease_linear_array(time, start_value, value_increase, total_time):
+    return value_increase * (time / total_time) + start_value
+
+def ease_in_out_cubic_array(time, start_value, value_increase, total_time):
+    time = time / (total_time / 2)
+    return numpy.where(time < 1,
+                       value_increase / 2 * time ** 3 + start_value,
+                       value_increase / 2 * ((time - 2) ** 3 + 2) + start_value)
+
+def ease_quintic_out_array(time, start_value, value_increase, total_time):
+    return value_increase * ((time / total_time - 1) ** 5 + 1) + start_value
+
+def ease_circular_in_array(time, start_value, value_increase, total_time):
+    return -value_increase * (numpy.sqrt(1 - (time / total_time) ** 2) - 1) + start_value
+
+array_versions = {
+    ease_linear: ease_linear_array,
+    ease_in_out_cubic: ease_in_out_cubic_array,
+    ease_quintic_out: ease_quintic_out_array,
+    ease_circular_in: ease_circular_in_array,
+}
+builtin_eases = set(array_versions)
+
+def get_array_version(ease):
+    # None for other easing functions, or without NumPy
+    if numpy is None:
+        return None
+    return array_versions.get(ease)
+
 '''
 try:
     from libraries.easing import cyeasing
@@ -10,7 +10,6 @@ import playeritems # Drops
 import utils
 import projectiles
 import statuseffects
-import pathfinding
 
 print("Load enemies")
 
@@ -30,11 +29,22 @@ class BaseEnemy(BaseSprite):
     base_max_health_points = 1
     damage_on_player_touch = False
     drops = {}
+    # Level of detail (see scheduler.EntityScheduler): ticks between thinks
+    # near the player, further away and far away, and whether the enemy
+    # may stop updating when it's far, idle (is_idle) and unseen
+    think_intervals = (1, 1, 1)
+    sleeps_when_idle = False
+    # Whether its update does more than its status effects without the
+    # player (rooms without such enemies aren't simulated off-screen)
+    acts_without_player = False
     def __init__(self, level, spawner_tile):
         super().__init__()
         self.level, self.spawner_tile = level, spawner_tile
         self.rect = pygame.Rect((0, 0), self.size)
         self.rect.center = self.spawner_tile.rect.center
+        # Set by the level's scheduler before every update
+        self.think_this_tick = True
+        self.think_ticks = self.elapsed_ticks = 1
         self.move_speed = self.damage = self.max_health_points = None
         self.reset_attributes()
         self.health_points = self.max_health_points
@@ -46,7 +56,11 @@ class BaseEnemy(BaseSprite):
     def update(self):
         player = self.level.parent.player
         self.reset_attributes()
-        self.status_effects.update()
+        if self.level.fast_forwarding:
+            # Advanced in one go by the level
+            self.status_effects.apply_modifiers()
+        else:
+            self.status_effects.update()
         if self.damage_on_player_touch and player is not None:
             if self.rect.colliderect(player.rect):
                 player.take_damage(self.damage)
@@ -59,7 +73,6 @@ class BaseEnemy(BaseSprite):
         self.draw_hp_bar(screen, pos_fix)
 
     def draw_hp_bar(self, screen, pos_fix=(0, 0)):
-        nearby = self.get_tiles_next_to() + [self.closest_tile_index]
         if self.health_points < self.max_health_points and not self.is_overdrawn:
             pos = self.hp_bar_rect.topleft
             if self.dead:
@@ -111,6 +124,9 @@ class BaseEnemy(BaseSprite):
     def get_item_drops(dropdict, specifier="any"):
         return []
 
+    def is_idle(self):
+        return False
+
     def heal(self, value):
         self.take_damage(-value)
 
@@ -125,6 +141,10 @@ class GrayGoo(BaseEnemy):
     damage_on_player_touch = True
     size = (30, 30)
     surface = imglib.load_image_from_file("images/dd/enemies/GrayGoo.png", after_scale=size)
+    # Away from the player it moves less often, but as far
+    think_intervals = (1, 2, 4)
+    sleeps_when_idle = True
+    acts_without_player = True
     def __init__(self, level, spawner_tile):
         super().__init__(level, spawner_tile)
         self.ticks_to_wait = 0
@@ -133,26 +153,34 @@ class GrayGoo(BaseEnemy):
 
     def update(self):
         super().update()
+        if not self.think_this_tick:
+            return
         last_rect = self.rect
-        if not self.ticks_to_wait:
+        if self.ticks_to_wait < self.think_ticks:
+            self.move_speed *= self.think_ticks - self.ticks_to_wait
+            self.ticks_to_wait = 0
             self.moving[self.direction] = True
             self.handle_moving()
             if self.rect == last_rect:
                 self.set_random_move_direction()
         else:
-            self.ticks_to_wait -= 1
+            self.ticks_to_wait -= self.think_ticks
+
+    def is_idle(self):
+        # Wandering around, with nothing going on that its update would handle
+        return not self.status_effects.effects and self.health_points > 0
 
     def set_random_move_direction(self):
         possible_directions = []
         col, row = self.closest_tile_index
-        level_size = self.level.layout_size
-        if col > 0 and self.level.layout[row][col - 1].passable:
+        grid = self.level.passable_grid
+        if grid.get(col - 1, row):
             possible_directions.append("left")
-        if col < level_size[0] - 1 and self.level.layout[row][col + 1].passable:
+        if grid.get(col + 1, row):
             possible_directions.append("right")
-        if row > 0 and self.level.layout[row - 1][col].passable:
+        if grid.get(col, row - 1):
             possible_directions.append("up")
-        if row < level_size[1] - 1 and self.level.layout[row + 1][col].passable:
+        if grid.get(col, row + 1):
             possible_directions.append("down")
         if not possible_directions:
             possible_directions = ["left", "right", "up", "down"]
@@ -179,44 +207,56 @@ class SkeletonArcher(BaseEnemy):
     size = (30, 30)
     surface = imglib.load_image_from_file("images/sl/enemies/SkeletonArcher.png", after_scale=size)
     shot_cooldown = 70
+    # Line of sight and the next step of the path are rechecked less often
+    think_intervals = (1, 2, 4)
     def __init__(self, level, spawner_tile):
         super().__init__(level, spawner_tile)
         self.next_shot = self.shot_cooldown
         self.last_rect = None
         self.path_obstructed = False
         self.moving = {k: False for k in base_directions}
-        self.last_path_target = None
-        self.path_to_player = []
         self.current_target = None
 
 
     def update(self):
         super().update()
         player = self.level.parent.player
-        for p in pathfinding.get_sprite_path_npoints(self, player):
-            if not self.level.layout[p[1]][p[0]].passable:
-                self.path_obstructed = True
-                self.moving = {k: False for k in base_directions}
-                break
-        else:
-            self.path_obstructed = False
-            self.moving = False
-            self.path_to_player = []
+        if player is None:
+            # Simulated without the player (see offscreen): it has nobody
+            # to walk to or shoot at, so it stands still and reloads
+            self.moving = {k: False for k in base_directions}
             self.current_target = None
+            self.next_shot = max(0, self.next_shot - self.elapsed_ticks)
+            return
+        if self.think_this_tick:
+            if not self.level.los_cache.get(self.closest_tile_index, player.closest_tile_index):
+                self.path_obstructed = True
+            else:
+                self.path_obstructed = False
+                self.current_target = None
         if self.next_shot <= 0 and not self.path_obstructed:
             p = projectiles.Arrow.towards(self.level, self.rect.center, player.rect.center)
             self.level.sprites.append(p)
             self.next_shot = self.shot_cooldown * (self.base_move_speed / self.move_speed)
-        self.next_shot -= 1
-        cpoint = self.closest_tile_index
-        p1, p2 = cpoint, player.closest_tile_index
-        if self.path_obstructed and self.last_path_target != p2:
-            self.last_path_target = p2
-            self.path_to_player = pathfinding.a_star_in_level(p1, p2, self.level.layout)
-        if self.path_to_player:
+        self.next_shot -= self.elapsed_ticks
+        # Ticks that were skipped (see scheduler.EntityScheduler.coarse) are moved too
+        for _ in range(self.elapsed_ticks):
+            self.move_on_path()
+
+    def move_on_path(self):
+        self.moving = {k: False for k in base_directions}
+        if self.path_obstructed:
+            # Center on the current tile first, then follow the level's flow field
+            flow = self.level.get_player_flow_field()
             while self.current_target is None or self.current_target == self.rect.center:
-                p = self.path_to_player.pop()
+                if self.current_target is None:
+                    p = self.closest_tile_index
+                else:
+                    p = flow.next_tile(*self.closest_tile_index)
+                    if p is None:
+                        break
                 self.current_target = self.level.layout[p[1]][p[0]].rect.center
+        if self.path_obstructed and self.current_target != self.rect.center:
             t, c = self.current_target, self.rect.center
             d1, d2 = utils.sign(t[0] - c[0]), utils.sign(t[1] - c[1])
             if d1 == -1:
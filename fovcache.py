@@ -0,0 +1,195 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import pygame
+
+import json_ext as json
+from libraries import fovlib
+
+print("Load FOV caches")
+
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
+# Vision maps are bitsets (ints), with the bit row * width + col set for every
+# lit tile, so that they are merged with a single |
+
+def to_bits(flags):
+    bits = 0
+    for idx, flag in enumerate(flags):
+        if flag:
+            bits |= 1 << idx
+    return bits
+
+def bits_to_tiles(bits, width):
+    # (col, row) of the set bits
+    tiles = []
+    idx = 0
+    while bits:
+        if bits & 1:
+            tiles.append((idx % width, idx // width))
+        bits >>= 1
+        idx += 1
+    return tiles
+
+class _RecordingRow:
+    # A row of the transparency map that marks the tiles read from it
+    __slots__ = ("row", "base", "reads")
+    def __init__(self, row, base, reads):
+        self.row, self.base, self.reads = row, base, reads
+
+    def __len__(self):
+        return len(self.row)
+
+    def __getitem__(self, col):
+        self.reads[self.base + col] = 1
+        return self.row[col]
+
+def calculate_fov_bits(grid, col, row, radius):
+    """
+    fovlib.calculate_fov over a grid (levelgrid.TileGrid of transparency),
+    as the bitset of lit tiles and the bitset of tiles the result depends on
+    (those whose transparency was looked at).
+    """
+    width, height = grid.width, grid.height
+    reads = bytearray(width * height)
+    rows = [_RecordingRow(grid.rows[r], r * width, reads) for r in range(height)]
+    light_map = fovlib.calculate_fov(rows, col, row, radius)
+    lit = to_bits(flag for light_row in light_map for flag in light_row)
+    return lit, to_bits(reads)
+
+
+class FovTable:
+    """
+    Vision of every tile of a level class, computed on its layout template
+    the first time it's needed and shared by all levels of the class.
+    Entries are (lit bits, read bits), keyed by (col, row, radius).
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, col, row, radius):
+        key = (col, row, radius)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = calculate_fov_bits(self.grid, col, row, radius)
+        return entry
+
+
+class FovCache:
+    """
+    Vision for a level, from the FovTable of its class. The tiles where the
+    level's transparency differs from the template (e.g. uncovered hidden rooms)
+    are tracked as a bitset, entries that read any of them are computed for
+    the level itself and kept until one of the tiles they read changes again.
+    """
+    def __init__(self, level):
+        self.level = level
+        self.table = None
+        self.template_grid = None
+        self.changed = 0
+        self.version = None
+        # (col, row, radius) -> (lit bits, read bits)
+        self.own_entries = {}
+
+    def __len__(self):
+        return len(self.own_entries)
+
+    def clear(self):
+        self.own_entries.clear()
+        self.version = None
+
+    def update_changed(self):
+        # The grid that levels give fovlib (see BaseLevel.create_transparency_map)
+        grid = self.level.passable_grid
+        if self.table is None:
+            self.table = type(self.level).get_fov_table()
+            self.template_grid = self.table.grid
+        data, template = grid.data, self.template_grid.data
+        changed = to_bits(a != b for a, b in zip(data, template)) if data != template else 0
+        # Only the entries that read a tile which changed since are thrown away
+        flipped = changed ^ self.changed
+        if flipped:
+            self.own_entries = {key: entry for key, entry in self.own_entries.items()
+                                if not entry[1] & flipped}
+        self.changed = changed
+        self.version = self.level.layout_version
+
+    def get(self, col, row, radius):
+        # Bitset of the tiles lit from the tile
+        if self.version != self.level.layout_version:
+            self.update_changed()
+        key = (col, row, radius)
+        entry = self.own_entries.get(key)
+        if entry is None:
+            entry = self.table.get(col, row, radius)
+            if entry[1] & self.changed:
+                entry = self.own_entries[key] = calculate_fov_bits(self.level.passable_grid, col, row, radius)
+        return entry[0]
+
+
+class FogOverlay:
+    """
+    Black over the tiles of a level that weren't seen yet, kept in a single
+    surface where the seen tiles are transparent. Only the tiles newly added
+    to the vision are cleared (reveal), so drawing it is one blit, whatever
+    is left unseen. A run-length encoded colorkey blits faster than per-pixel
+    alpha, and faster still the less fog is left.
+    """
+    clear_color = (255, 0, 255)
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.surface = pygame.Surface((width * tile_size, height * tile_size))
+        self.surface.fill((0, 0, 0))
+        self.surface.set_colorkey(self.clear_color, pygame.RLEACCEL)
+        self.seen = 0 # bitset
+        # Same as seen, one byte per tile (for NumPy)
+        self.seen_mask = bytearray(width * height)
+
+    def reveal(self, bits):
+        # Returns the bitset of the tiles that weren't seen before
+        new = bits & ~self.seen
+        if new:
+            self.seen |= new
+            for col, row in bits_to_tiles(new, self.width):
+                self.seen_mask[row * self.width + col] = 1
+                self.surface.fill(self.clear_color, (col * tile_size, row * tile_size, tile_size, tile_size))
+        return new
+
+    def draw(self, screen, pos_fix=(0, 0)):
+        screen.blit(self.surface, pos_fix)
+
+    def covers(self, rect):
+        # Whether every tile under the rect is unseen (rects outside of the level are never covered)
+        c0, r0 = max(int(rect.left // tile_size), 0), max(int(rect.top // tile_size), 0)
+        c1 = min(int((rect.right - 1) // tile_size), self.width - 1)
+        r1 = min(int((rect.bottom - 1) // tile_size), self.height - 1)
+        if c1 < c0 or r1 < r0:
+            return False
+        span = (1 << (c1 - c0 + 1)) - 1
+        seen, width = self.seen, self.width
+        for row in range(r0, r1 + 1):
+            if seen >> (row * width + c0) & span:
+                return False
+        return True
+
+    def covers_array(self, lefts, tops, sizes):
+        # covers for square rects given as NumPy arrays, as a boolean array
+        mask = numpy.frombuffer(self.seen_mask, numpy.uint8)
+        width, height = self.width, self.height
+        covered = numpy.ones(len(lefts), bool)
+        any_inside = numpy.zeros(len(lefts), bool)
+        # Rects smaller than a tile are over at most the tiles under their corners
+        for col in (lefts // tile_size, (lefts + sizes - 1) // tile_size):
+            for row in (tops // tile_size, (tops + sizes - 1) // tile_size):
+                inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+                idx = numpy.where(inside, row * width + col, 0)
+                covered &= ~inside | (mask[idx] == 0)
+                any_inside |= inside
+        return covered & any_inside
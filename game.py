@@ -4,6 +4,8 @@ import pygame
 
 from states import MainMenuState
 import mazegen, mapgen
+import pathfinding
+import offscreen
 from player import PlayerCharacter
 import controls
 
@@ -18,9 +20,10 @@ class GameEngine:
         "DEBUG": True,
         "screen": None, "draw_surface": None, "screen_size": None,
         "level_caches": {}, "map": None, 
-        "maze": None, "player_mazepos": None,
+        "maze": None, "player_mazepos": None, "maze_graph": None,
         "enable_fov": False, "forced_mouse": True,
-        "enable_death": False
+        "enable_death": False, "dirty_rects": False,
+        "offscreen_simulation": False
     }
     def __init__(self, **kwargs):
         self.vars = self.default_vars.copy()
@@ -29,12 +32,14 @@ class GameEngine:
         self.gticks = 0 # Global ticks
         self.ticks = 0  # Game ticks, active playing time (not paused or in menus)
         self.player = None
+        self.offscreen = offscreen.OffscreenSimulation(self)
         self.reset_game()
         self.push_state(MainMenuState(self, fade_in=True))
 
     def reset_game(self):
         self.player = PlayerCharacter(self)
         self.vars["level_caches"].clear()
+        self.offscreen.clear()
 
     def new_game(self):
         gen = mazegen.MazeGenerator(*self.vars["mapsize"])
@@ -47,12 +52,20 @@ class GameEngine:
         start_level = self.vars["map"][gen.start_pos[1]][gen.start_pos[0]]
         return start_level
 
+    @property
+    def maze_graph(self):
+        # pathfinding.MazeGraph of the current map, built on first use
+        graph = self.vars["maze_graph"]
+        if graph is None or graph.level_map is not self.vars["map"]:
+            graph = self.vars["maze_graph"] = pathfinding.MazeGraph(self.vars["map"])
+        return graph
+
     @property
     def top_state(self):
         return self.state_stack[-1] if self.state_stack else None
 
     def cleanup(self):
-        pass
+        self.offscreen.stop()
 
     def push_state(self, state):
         log("Push state {} to the stack".format(type(state).__name__))
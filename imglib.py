@@ -136,6 +136,34 @@ class ColorBorderDrawer:
             surface.fill(color, rect)
         return rects
 
+class DrawRecorder:
+    """
+    Stands in for a surface when drawing, and records the rects
+    changed by blit and fill (e.g. for pygame.display.update).
+    Other attributes are taken from the surface.
+    """
+    def __init__(self, surface):
+        self.surface = surface
+        self.rects = []
+
+    def blit(self, *args, **kwargs):
+        rect = self.surface.blit(*args, **kwargs)
+        self.rects.append(rect)
+        return rect
+
+    def fill(self, *args, **kwargs):
+        rect = self.surface.fill(*args, **kwargs)
+        self.rects.append(rect)
+        return rect
+
+    def blits(self, blit_sequence, doreturn=True):
+        rects = self.surface.blits(blit_sequence, True)
+        self.rects.extend(rects)
+        return rects if doreturn else None
+
+    def __getattr__(self, name):
+        return getattr(self.surface, name)
+
 cborders_cache = {}
 def color_border(size, color, thickness, nowarn=False):
     if not nowarn:
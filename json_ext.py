@@ -12,9 +12,10 @@ if zipopen.enable_resource_zip:
 print("Load JSON parser")
 
 json_cache = {}
-def loads(string, arrays_to_tuples=True, register_aware=True, **kwargs):
+def loads(string, arrays_to_tuples=True, register_aware=True, cache=True, **kwargs):
+    # Strings that are only loaded once (e.g. level caches) shouldn't be cached
     params = (string, arrays_to_tuples)
-    if params not in json_cache:
+    if params not in json_cache or not cache:
         this = json.loads(string, **kwargs)
         # Analyze the input and apply fixes
         stack = [this]
@@ -49,6 +50,8 @@ def loads(string, arrays_to_tuples=True, register_aware=True, **kwargs):
 
         for a, b in arrays_to_convert:
             a[b] = tuple(a[b])
+        if not cache:
+            return this
         json_cache[params] = this
     return json_cache[params]
 
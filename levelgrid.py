@@ -0,0 +1,144 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import pygame
+
+import json_ext as json
+
+print("Load level grids")
+
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
+class TileGrid:
+    """
+    A grid of small integers (one byte per tile), stored row-major
+    in a flat bytearray. Python code reads it by index (data[row * width + col]
+    or the bounds-checked get), vectorized code can use the NumPy view (array),
+    which shares memory with the bytearray and so is always up to date.
+    """
+    def __init__(self, width, height, fill=0):
+        self.width, self.height = width, height
+        self.data = bytearray([fill]) * (width * height)
+        self._array = None
+        # Row views, usable as a 2d list (grid.rows[row][col])
+        view = memoryview(self.data)
+        self.rows = [view[row * width:(row + 1) * width] for row in range(height)]
+
+    @classmethod
+    def from_layout(cls, layout, getter):
+        self = cls(len(layout[0]), len(layout))
+        for row, tilerow in enumerate(layout):
+            for col, tile in enumerate(tilerow):
+                self.data[row * self.width + col] = getter(tile)
+        return self
+
+    def index(self, col, row):
+        return row * self.width + col
+
+    def inside(self, col, row):
+        return 0 <= col < self.width and 0 <= row < self.height
+
+    def get(self, col, row, default=0):
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return self.data[row * self.width + col]
+        return default
+
+    def set(self, col, row, value):
+        self.data[row * self.width + col] = value
+
+    def copy(self):
+        grid = type(self)(self.width, self.height)
+        grid.data[:] = self.data
+        return grid
+
+    @property
+    def array(self):
+        # (height, width) uint8 array, without copying
+        if numpy is None:
+            raise ImportError("NumPy is required for array access to level grids")
+        if self._array is None:
+            self._array = numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(self.height, self.width)
+        return self._array
+
+
+class OccluderMap:
+    """
+    Tiles that hide the sprites drawn over them (non-transparent tiles,
+    which levels draw again on top). mask has a 1 for each of those,
+    rects are the same tiles merged into horizontal runs, so that sprites
+    in the open can be told apart with a single collidelist.
+    """
+    def __init__(self, transparent_grid):
+        self.width, self.height = transparent_grid.width, transparent_grid.height
+        self.mask = bytearray(not value for value in transparent_grid.data)
+        self.row_rects = [self.get_row_rects(row) for row in range(self.height)]
+        self.rects = []
+        self.update_rects()
+
+    def copy(self):
+        occluders = object.__new__(type(self))
+        occluders.width, occluders.height = self.width, self.height
+        occluders.mask = self.mask[:]
+        # Rects are never changed in place, only replaced
+        occluders.row_rects = self.row_rects[:]
+        occluders.rects = self.rects[:]
+        return occluders
+
+    def get_row_rects(self, row):
+        result = []
+        mask, width = self.mask, self.width
+        base = row * width
+        col = 0
+        while col < width:
+            if mask[base + col]:
+                start = col
+                while col < width and mask[base + col]:
+                    col += 1
+                result.append(pygame.Rect(start * tile_size, row * tile_size,
+                                          (col - start) * tile_size, tile_size))
+            else:
+                col += 1
+        return result
+
+    def update_rects(self):
+        self.rects = [rect for rects in self.row_rects for rect in rects]
+
+    def set(self, col, row, occluding):
+        idx = row * self.width + col
+        if self.mask[idx] != bool(occluding):
+            self.mask[idx] = bool(occluding)
+            self.row_rects[row] = self.get_row_rects(row)
+            self.update_rects()
+
+    def get_overlapping(self, rect):
+        # Occluding tiles (col, row) under the rect
+        if rect.collidelist(self.rects) == -1:
+            return ()
+        c0, r0 = max(int(rect.left // tile_size), 0), max(int(rect.top // tile_size), 0)
+        c1 = min(int((rect.right - 1) // tile_size), self.width - 1)
+        r1 = min(int((rect.bottom - 1) // tile_size), self.height - 1)
+        mask, width = self.mask, self.width
+        return [(col, row) for row in range(r0, r1 + 1) for col in range(c0, c1 + 1)
+                if mask[row * width + col]]
+
+
+def flag_bit(flag):
+    return 1 << flag.value
+
+def flagset_bits(flagset):
+    bits = 0
+    for flag in flagset.flagset:
+        bits |= 1 << flag.value
+    return bits
+
+def tile_flag_bits(tile):
+    return flagset_bits(tile.flags)
+
+def tile_rect_collides(rect, col, row):
+    # Same as rect.colliderect(tile.rect), without the tile object
+    x, y = col * tile_size, row * tile_size
+    return rect.left < x + tile_size and x < rect.right and \
+           rect.top < y + tile_size and y < rect.bottom
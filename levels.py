@@ -8,7 +8,15 @@ import pygame
 import imglib
 import json_ext as json
 from abc_level import AbstractLevel
+import fovcache
 import leveltiles
+import levelgrid
+import particles
+import pathfinding
+import projectiles
+import raycast
+import scheduler
+import spatialhash
 from colors import Color
 import zipopen
 import utils
@@ -38,6 +46,24 @@ opposite_dirs = {"left": "right", "right": "left",
 all_levels = [] #level_creator automatically populates this list
 all_gen_levels = [] # used by the generator, all_levels is for the register
 
+# Baked level renders (background and tiles), keyed by BaseLevel.get_render_key.
+# Shared between levels, so they are never drawn on: a level that
+# changes takes a copy (see BaseLevel.update_dirty_tiles).
+render_cache = {}
+render_cache_size = 64
+
+def cache_render(key, render):
+    # The least recently used render is evicted
+    if len(render_cache) >= render_cache_size:
+        del render_cache[next(iter(render_cache))]
+    render_cache[key] = render
+
+def get_cached_render(key):
+    render = render_cache.pop(key, None)
+    if render is not None:
+        render_cache[key] = render
+    return render
+
 def logic_xnor(first, second):
     return bool(first) is bool(second)
 
@@ -99,26 +125,100 @@ class BaseLevel(AbstractLevel):
         # has a 'player' and 'game' attribute
         self.parent = None
         self.force_full_update = self.force_render_update = False
+        # Per-tile attributes as flat grids (see levelgrid.TileGrid), kept in sync
+        # with the layout by refresh_tile. layout_version changes along with them.
+        self.passable_grid = self.transparent_grid = self.flags_grid = None
+        self.occluders = None # levelgrid.OccluderMap
+        self.layout_version = 0
+        self.los_cache = raycast.LineOfSightCache(self)
+        # Vision from the tiles, as bitsets (see fovcache)
+        self.fov_cache = fovcache.FovCache(self)
+        # fovcache.FogOverlay of the player, if its FOV is enabled.
+        # Sprites and particles entirely under the fog are not drawn.
+        self.fog_overlay = None
+        # pathfinding.PathGrid of the passable_grid, rebuilt when the layout_version changes
+        self.path_grid = None
+        self.path_grid_version = None
+        # pathfinding.FlowField towards a tile (the player's), shared by the enemies
+        self.flow_field = None
+        self.flow_field_key = None
+        self.flow_field_request = self.flow_field_request_key = None
+        # Searches run under a time budget at the end of every tick
+        self.path_requests = pathfinding.PathRequestQueue()
         self.transparency_map = None
         self.cache_to_load = None # set by load_from_cache
+        # Sprites bucketed by tiles, for area queries (e.g. dealing damage)
+        self.spatial_hash = spatialhash.SpatialHash()
+        # Straight-line projectiles, simulated together (None without NumPy)
+        self.projectile_batch = None
+        # Which sprites update and think during a tick
+        self.scheduler = scheduler.EntityScheduler(self)
+        # Set during fast_forward
+        self.fast_forwarding = False
+        # Tiles that are updated every tick (dict used as an ordered set)
+        self.active_tiles = {}
+        # Tiles whose appearance changed since the last render,
+        # only these are redrawn into current_render (see update_dirty_tiles)
+        self.dirty_tiles = {}
+        self.stateful_tiles = []
+        # Tiles redrawn into current_render during the last tick, and in total
+        self.redrawn_tiles_count = self.redrawn_tiles_total = 0
         if not manual_init:
             self.init_level()
         self.background = imglib.repeated_image_texture(self.bg_tile, level_surface_size)
-        self.current_render = pygame.Surface(level_surface_size).convert()
+        self.current_render = None # from render_cache
         self.redrawn = set()
 
     def init_level(self):
         if not self.initialized:
             super().__init__()
+            self.particles = particles.create_particle_container(self)
+            self.stateful_tiles = [self.layout[row][col] for col, row, _ in
+                                   self.get_layout_template().stateful]
+            self.sprites.add_index(self.spatial_hash)
+            self.sprites.add_index(self.scheduler)
+            self.projectile_batch = projectiles.create_projectile_batch(self)
+            if self.projectile_batch is not None:
+                self.sprites.add_index(self.projectile_batch)
+            for row in self.layout:
+                for tile in row:
+                    if tile.needs_update:
+                        self.subscribe_tile(tile)
             self.force_full_update = True
             self.force_render_update = True
+            self.create_grids()
             self.transparency_map = self.create_transparency_map() # passability for collisions
             if self.cache_to_load is not None:
                 self.load_cache(self.cache_to_load)
             self.initialized = True
 
+    @classmethod
+    def get_layout_template(cls):
+        # Parsed once per level class, on first use
+        if "_layout_template" not in cls.__dict__:
+            cls._layout_template = leveltiles.LayoutTemplate(cls.raw_layout)
+        return cls._layout_template
+
+    @classmethod
+    def get_door_costs(cls):
+        # Path lengths between the doors of the layout, once per level class
+        # (for pathfinding.MazeGraph, hidden rooms and other changes are not seen)
+        if "_door_costs" not in cls.__dict__:
+            doors = {direction: cls.start_entries[direction] for direction in opposite_dirs
+                     if cls.start_entries[direction] is not None}
+            path_grid = pathfinding.PathGrid(cls.get_layout_template().passable_grid)
+            cls._door_costs = pathfinding.door_costs(path_grid, doors)
+        return cls._door_costs
+
+    @classmethod
+    def get_fov_table(cls):
+        # Shared by all levels of the class, filled as the tiles are visited
+        if "_fov_table" not in cls.__dict__:
+            cls._fov_table = fovcache.FovTable(cls.get_layout_template().passable_grid)
+        return cls._fov_table
+
     def get_layout_copy(self):
-        return leveltiles.parse_layout(self.raw_layout, self)
+        return self.get_layout_template().instantiate(self)
 
     @property
     def layout_size(self):
@@ -177,50 +277,191 @@ class BaseLevel(AbstractLevel):
     def stop(self):
         return self.create_cache()
 
+    def subscribe_tile(self, tile):
+        self.active_tiles[tile] = None
+
+    def unsubscribe_tile(self, tile):
+        self.active_tiles.pop(tile, None)
+
+    def create_grids(self):
+        # The layout was just instantiated, so it matches the template
+        template = self.get_layout_template()
+        self.passable_grid = template.passable_grid.copy()
+        self.transparent_grid = template.transparent_grid.copy()
+        self.flags_grid = template.flags_grid.copy()
+        self.occluders = template.occluders.copy()
+        self.layout_version += 1
+
+    def refresh_tile(self, tile):
+        # Should be called by tiles after they mutate
+        col, row = tile.col_idx, tile.row_idx
+        self.passable_grid.set(col, row, tile.passable)
+        self.transparent_grid.set(col, row, tile.transparent)
+        self.flags_grid.set(col, row, levelgrid.tile_flag_bits(tile))
+        self.occluders.set(col, row, not tile.transparent)
+        self.layout_version += 1
+        self.dirty_tiles[tile] = None
+
+    def get_path_grid(self):
+        if self.path_grid is None or self.path_grid_version != self.layout_version:
+            self.path_grid = pathfinding.PathGrid(self.passable_grid)
+            self.path_grid_version = self.layout_version
+        return self.path_grid
+
+    def get_flow_field(self, goal):
+        # Recomputed only after the goal or the layout changes. The new field
+        # is built by path_requests, until then the last one is used.
+        key = (goal, self.layout_version)
+        if self.flow_field is None:
+            self.set_flow_field(pathfinding.FlowField(self.get_path_grid(), goal), key)
+        elif self.flow_field_key != key and self.flow_field_request_key != key:
+            if self.flow_field_request is not None:
+                self.flow_field_request.cancel()
+            callback = lambda field: self.set_flow_field(field, key)
+            self.flow_field_request = self.path_requests.submit_flow_field(self.get_path_grid(), goal, callback)
+            self.flow_field_request_key = key
+        return self.flow_field
+
+    def set_flow_field(self, field, key):
+        self.flow_field, self.flow_field_key = field, key
+        self.flow_field_request = self.flow_field_request_key = None
+
+    def get_player_flow_field(self):
+        return self.get_flow_field(self.parent.player.closest_tile_index)
+
+    def mark_overdrawn(self, rect):
+        # Called by sprites (and particles) after being drawn,
+        # the occluding tiles under them are drawn again over them.
+        # Returns whether the rect is under any of those.
+        tiles = self.occluders.get_overlapping(rect)
+        if tiles:
+            self.redrawn.update(tiles)
+            return True
+        return False
+
     def create_transparency_map(self):
-        return [[tile.passable for tile in row] for row in self.layout]
+        # Row views of the passability grid, so it never goes out of date
+        return self.passable_grid.rows
+
+    def get_render_key(self):
+        return type(self), tuple(tile.render_state for tile in self.stateful_tiles)
 
     def update_render(self):
-        self.current_render.blit(self.background, TOPLEFT)
-        for row in self.layout:
-            for tile in row:
-                self.current_render.blit(tile.surface, tile.rect)
+        key = self.get_render_key()
+        render = get_cached_render(key)
+        if render is None:
+            render = pygame.Surface(level_surface_size).convert()
+            render.blit(self.background, TOPLEFT)
+            for row in self.layout:
+                for tile in row:
+                    render.blit(tile.surface, tile.rect)
+            self.count_redrawn_tiles(self.width * self.height)
+            cache_render(key, render)
+        self.current_render = render
+        self.dirty_tiles.clear()
+
+    def update_dirty_tiles(self):
+        key = self.get_render_key()
+        render = get_cached_render(key)
+        if render is None:
+            # Copy on write, then recompose only the
+            # changed tiles (background included)
+            render = self.current_render.copy()
+            for tile in self.dirty_tiles:
+                render.blit(self.background, tile.rect, tile.rect)
+                render.blit(tile.surface, tile.rect)
+            self.count_redrawn_tiles(len(self.dirty_tiles))
+            cache_render(key, render)
+        self.current_render = render
+        self.dirty_tiles.clear()
+
+    def count_redrawn_tiles(self, count):
+        self.redrawn_tiles_count += count
+        self.redrawn_tiles_total += count
 
     def update_full(self):
-        self.create_transparency_map()
+        self.transparency_map = self.create_transparency_map()
         self.update_render()
 
     def update(self):
         self.redrawn.clear()
+        self.redrawn_tiles_count = 0
         if self.force_full_update:
             self.update_full()
             self.force_full_update = False
             self.force_render_update = False
-        for row in self.layout:
-            for tile in row:
-                if tile.needs_update:
-                    tile.update()
-        # The sprites may decide to remove themselves, so we need a copy
-        for sprite in self.sprites.copy():
-            sprite.update()
-        for particle in self.particles.copy():
-            particle.update()
+        # Tiles may unsubscribe themselves while updating
+        for tile in list(self.active_tiles):
+            tile.update()
+        # The sprites may decide to remove themselves (or spawn others),
+        # these changes are buffered and applied after all sprites are updated
+        self.sprites.defer_changes()
+        if self.projectile_batch is not None:
+            self.projectile_batch.update()
+        schedule = self.scheduler.schedule
+        self.scheduler.begin_tick()
+        for sprite in self.sprites:
+            # Skip sprites removed earlier during this tick
+            if sprite in self.sprites and schedule(sprite):
+                sprite.update()
+                self.spatial_hash.update(sprite)
+        self.sprites.apply_changes()
+        self.update_particles()
+        self.path_requests.run()
+
+    def update_particles(self):
+        self.particles.update()
+
+    def fast_forward(self, ticks):
+        """
+        Catches up on ticks the level missed (e.g. while the player was elsewhere),
+        without the cosmetic parts: particles are dropped, status effects
+        are applied at once for all the ticks, and enemies are only updated
+        when they think, doing the ticks in between at the same time.
+        """
+        if ticks <= 0:
+            return
+        for sprite in self.sprites:
+            status_effects = getattr(sprite, "status_effects", None)
+            if status_effects is not None:
+                status_effects.fast_forward(ticks)
+        level_particles, self.particles = self.particles, particles.NullParticles()
+        self.fast_forwarding = self.scheduler.coarse = True
+        try:
+            for _ in range(ticks):
+                self.update()
+        finally:
+            self.particles = level_particles
+            self.fast_forwarding = self.scheduler.coarse = False
 
     def handle_events(self, events, pressed_keys, mouse_pos):
         pass
 
-    def draw(self, screen, pos_fix=TOPLEFT):
-        if self.force_render_update:
+    def prepare_render(self):
+        if self.force_render_update or self.current_render is None:
             self.update_render()
             self.force_render_update = False
+        elif self.dirty_tiles:
+            self.update_dirty_tiles()
+
+    def draw(self, screen, pos_fix=TOPLEFT):
+        self.prepare_render()
         screen.blit(self.current_render, pos_fix)
+        self.draw_sprites(screen, pos_fix)
+
+    def draw_sprites(self, screen, pos_fix=TOPLEFT):
+        # Everything drawn over current_render
+        # Some sprites remove themselves while being drawn
+        self.sprites.defer_changes()
+        fog = self.fog_overlay
         for sprite in self.sprites:
-            sprite.draw(screen, pos_fix)
-        for particle in self.particles:
-            particle.draw(screen, pos_fix)
-        for col, row in self.redrawn:
-            tile = self.layout[row][col]
-            screen.blit(tile.surface, tile.rect.move(pos_fix))
+            if fog is None or not fog.covers(sprite.rect):
+                sprite.draw(screen, pos_fix)
+        self.sprites.apply_changes()
+        self.particles.draw(screen, pos_fix)
+        layout = self.layout
+        screen.blits([(layout[row][col].surface, layout[row][col].rect.move(pos_fix))
+                      for col, row in self.redrawn], False)
 
 # ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
 # ===== ===== =====      Level Factory      ===== ===== =====
@@ -8,6 +8,7 @@ from abc_leveltile import AbstractLevelTile
 from colors import Color
 import enemies
 from inventory import BaseInventory
+from levelgrid import TileGrid, OccluderMap, flagset_bits
 import utils
 
 print("Load level tiles")
@@ -20,6 +21,7 @@ class TileFlags(enum.Enum):
     Container = 4
 
 class FlagSet:
+    # Tiles share the FlagSet of their class, so it should not be changed
     def __init__(self, *flags):
         self.flagset = set(flags)
         self.nameset = set(flag.name for flag in flags)
@@ -43,10 +45,13 @@ class BaseTile(AbstractLevelTile):
     needs_update = False
     passable = True
     transparent = True
+    # Tiles that aren't stateful are created once per level class and
+    # shared by all of its levels (see LayoutTemplate), with level set to None
+    stateful = False
     flags_template = FlagSet()
     def __init__(self, level, col_idx, row_idx):
         super().__init__(level, col_idx, row_idx)
-        self.flags = self.flags_template.copy()
+        self.flags = self.flags_template
 
     @property
     def surface(self):
@@ -93,6 +98,7 @@ class HiddenRoomTile(BaseTile):
     needs_update = False
     passable = True
     transparent = False
+    stateful = True
     flags_template = FlagSet(TileFlags.PartOfHiddenRoom)
     drawn_surface = imglib.load_image_from_file("images/dd/env/Wall.png", after_scale=tile_size_t)
     uncovered_drawn_surface = pygame.Surface(tile_size_t)
@@ -102,10 +108,15 @@ class HiddenRoomTile(BaseTile):
         super().__init__(level, col_idx, row_idx)
         self.uncovered = False
 
+    @property
+    def render_state(self):
+        return self.uncovered
+
     def uncover(self):
         self.uncovered = True
         self.drawn_surface = self.uncovered_drawn_surface
         self.transparent = True
+        self.level.refresh_tile(self)
 
 class HiddenRoomDoorTile(HiddenRoomTile):
     drawn_surface = imglib.load_image_from_file("images/dd/env/DoorOnWall.png", after_scale=tile_size_t)
@@ -116,6 +127,7 @@ class HiddenRoomDoorTile(HiddenRoomTile):
 
 class BaseSpawnerTile(EmptyTile):
     needs_update = True
+    stateful = True
     spawned_enemy = None
     flags_template = FlagSet(TileFlags.EnemySpawner)
     def __init__(self, level, col_idx, row_idx):
@@ -127,6 +139,8 @@ class BaseSpawnerTile(EmptyTile):
             self.spawn = self.spawned_enemy(self.level, self)
             self.level.sprites.append(self.spawn)
             self.spawned = True
+            # Nothing left to do
+            self.unsubscribe()
             self.level.precache["tiles"].append({
                 "col": self.col_idx,
                 "row": self.row_idx,
@@ -135,6 +149,8 @@ class BaseSpawnerTile(EmptyTile):
 
     def load_cache(self, cache):
         self.spawned = cache["spawned"]
+        if self.spawned:
+            self.unsubscribe()
         # Retain the cache
         self.level.precache["tiles"].append(cache)
 
@@ -152,6 +168,7 @@ class BaseContainer(BaseTile):
     needs_update = True
     passable = True
     transparent = True
+    stateful = True
     flags_template = FlagSet(TileFlags.Container)
     # Don't change this
     inventory_slots = 8
@@ -216,13 +233,45 @@ parse_dict = {
 # We use flags_template since these are classes
 passage_chars = [k for k, v in parse_dict.items() if v.flags_template.Passage]
 
+class LayoutTemplate:
+    """
+    A parsed layout, created once per level class.
+    Stateless tiles are created here and shared by every level
+    instantiated from the template, stateful ones (spawners,
+    containers, hidden rooms) are created for each level.
+    Also holds the initial tile grids, copied by the levels.
+    """
+    def __init__(self, raw):
+        types = [[parse_dict[char] if char in parse_dict else MissingTile
+                 for char in row] for row in raw]
+        assert len(types) == level_size[1], "Height of level must be equal to {}".format(level_size[1])
+        assert len(types[0]) == level_size[0] and not any(len(types[0]) != len(types[i]) for i in range(len(types))), \
+               "Width of level must be equal to {}".format(level_size[0])
+        self.rows = []
+        self.stateful = [] # (col, row, tile type)
+        for ridx, row in enumerate(types):
+            tilerow = []
+            for cidx, tile_type in enumerate(row):
+                if tile_type.stateful:
+                    self.stateful.append((cidx, ridx, tile_type))
+                    tilerow.append(None)
+                else:
+                    tilerow.append(tile_type(None, cidx, ridx))
+            self.rows.append(tilerow)
+        # Built from the class attributes, which stateful tiles start with
+        self.passable_grid = TileGrid.from_layout(types, lambda t: t.passable)
+        self.transparent_grid = TileGrid.from_layout(types, lambda t: t.transparent)
+        self.flags_grid = TileGrid.from_layout(types, lambda t: flagset_bits(t.flags_template))
+        self.occluders = OccluderMap(self.transparent_grid)
+
+    def instantiate(self, level_obj):
+        result = [row.copy() for row in self.rows]
+        for col, row, tile_type in self.stateful:
+            result[row][col] = tile_type(level_obj, col, row)
+        return result
+
 def parse_layout(raw, level_obj):
-    result = [[(parse_dict[char] if char in parse_dict else MissingTile)(level_obj, cidx, ridx)
-              for cidx, char in enumerate(row)] for ridx, row in enumerate(raw)]
-    assert len(result) == level_size[1], "Height of level must be equal to {}".format(level_size[1])
-    assert len(result[0]) == level_size[0] and not any(len(result[0]) != len(result[i]) for i in range(len(result))), \
-           "Width of level must be equal to {}".format(level_size[0])
-    return result
+    return LayoutTemplate(raw).instantiate(level_obj)
 
 
 register = utils.Register.gather_type(AbstractLevelTile, locals())
\ No newline at end of file
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import sys
+
+import json_ext as json
+from offscreenworker import init_worker, simulate_room
+
+print("Load off-screen simulation")
+
+def get_context():
+    # Forked workers start with every module loaded, spawned ones
+    # (the only kind on Windows) import what they need (see offscreenworker)
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+def can_start_workers():
+    # Spawned workers import the main script again (as __mp_main__): fine
+    # for the launcher, whose frozen build hands them over to
+    # multiprocessing.freeze_support, but app.py would open the game in each
+    if get_context().get_start_method() != "spawn":
+        return True
+    main_file = getattr(sys.modules["__main__"], "__file__", None)
+    return main_file is None or os.path.basename(main_file) != "app.py"
+
+def needs_simulation(cache):
+    # Workers have no player: only enemies that act without one move
+    # (status effects are fast-forwarded anyway when the room is entered)
+    return any(sprite["type"] == "enemy" and sprite["cls"].acts_without_player
+               for sprite in cache["sprites"])
+
+class OffscreenSimulation:
+    """
+    Keeps the cached rooms near the player (up to max_distance doors away)
+    simulating in a pool of worker processes, at a low tick rate: every
+    interval ticks, the rooms without a job get one, which fast-forwards
+    their cache to the current tick (see simulate_room). Finished results
+    replace the caches in level_caches (merge) when the room is entered,
+    or when it gets its next job, unless the cache changed in the meantime.
+    The rooms are simulated without the player, so only enemies that act
+    without one (acts_without_player, such as wandering goos) change:
+    rooms without them are skipped (see needs_simulation).
+    Off unless the "offscreen_simulation" game var is set, the pool is
+    started the first time it is needed (if it can be, see can_start_workers).
+    """
+    max_distance = 3
+    interval = 300
+    max_ticks = 1000
+    def __init__(self, game, processes=None):
+        self.game = game
+        self.processes = processes
+        self.pool = None
+        self.unavailable = False
+        # maze position -> (cache the job started from, AsyncResult)
+        self.jobs = {}
+        self.last_submit = None
+        self.submitted = self.merged = 0
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def start(self):
+        # Returns whether the pool is running
+        if self.pool is None and not self.unavailable:
+            if can_start_workers():
+                self.pool = get_context().Pool(self.processes, initializer=init_worker)
+            else:
+                print("Off-screen simulation needs the game to be started from the launcher")
+                self.unavailable = True
+        return self.pool is not None
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.clear()
+
+    def clear(self):
+        # Results of the jobs still running are thrown away
+        self.jobs.clear()
+        self.last_submit = None
+
+    def get_nearby_rooms(self):
+        graph = self.game.maze_graph
+        rooms = graph.rooms_within(self.game.vars["player_mazepos"], self.max_distance)
+        caches = self.game.vars["level_caches"]
+        return [mazepos for mazepos, steps in rooms.items() if steps and mazepos in caches]
+
+    def update(self):
+        ticks = self.game.ticks
+        if self.last_submit is not None and ticks - self.last_submit < self.interval:
+            return
+        if not self.start():
+            return
+        self.last_submit = ticks
+        caches = self.game.vars["level_caches"]
+        for mazepos in self.get_nearby_rooms():
+            job = self.jobs.get(mazepos)
+            if job is not None:
+                if not job[1].ready():
+                    continue
+                self.merge(mazepos)
+            cache = caches[mazepos]
+            elapsed = min(self.max_ticks, ticks - cache["last_tick"])
+            if elapsed < self.interval or not needs_simulation(cache):
+                continue
+            col, row = mazepos
+            level_cls = self.game.vars["map"][row][col]
+            args = (level_cls.__name__, json.dumps(cache), elapsed, ticks)
+            self.jobs[mazepos] = (cache, self.pool.apply_async(simulate_room, args))
+            self.submitted += 1
+
+    def merge(self, mazepos):
+        # Put the result of the room's job into level_caches, if it is done
+        # and the cache is still the one it started from. Returns whether it was
+        job = self.jobs.pop(mazepos, None)
+        if job is None:
+            return False
+        base, result = job
+        if not result.ready() or not result.successful():
+            return False
+        caches = self.game.vars["level_caches"]
+        if caches.get(mazepos) is not base:
+            return False
+        caches[mazepos] = json.loads(result.get(), cache=False)
+        self.merged += 1
+        return True
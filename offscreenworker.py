@@ -0,0 +1,44 @@
+import os
+
+import json_ext as json
+
+# Entry point of the worker processes of offscreen.OffscreenSimulation.
+# Spawned workers import this module, never app (which opens the game window)
+
+class _WorkerGame:
+    # What levels use of the GameEngine while simulated in a worker
+    def __init__(self, ticks):
+        self.ticks = ticks
+        self.vars = {}
+
+class _WorkerState:
+    # Stands in for the DungeonState of a level simulated in a worker,
+    # there is no player (enemies have nobody to go after)
+    def __init__(self, game):
+        self.game = game
+        self.player = None
+
+def init_worker():
+    # Levels convert their images, which needs a display mode: spawned
+    # workers set one up on the dummy video driver, so no window is opened
+    # (forked workers have the one of the game already). SDL would otherwise
+    # catch the SIGTERM the pool stops its workers with
+    import pygame
+    if pygame.display.get_surface() is None:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+        pygame.display.init()
+        pygame.display.set_mode((1, 1))
+
+def simulate_room(level_name, cache_string, ticks, now):
+    """
+    Fast-forward a room from its cache (as saved by json_ext.dumps) by ticks,
+    taking it to the game tick now. Returns the new cache, in the same format.
+    """
+    import levels
+    cache = json.loads(cache_string, cache=False)
+    level = levels.register[level_name].load_from_cache(cache)
+    level.parent = _WorkerState(_WorkerGame(now))
+    level.init_level()
+    level.fast_forward(ticks)
+    return json.dumps(level.create_cache())
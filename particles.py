@@ -2,20 +2,31 @@ import random
 
 import pygame
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from basesprite import BaseSprite
 import imglib
 import utils
 import easing
+import json_ext as json
 
 print("Load particles")
 
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
 # Slowdown - start maximum, end 0
 _summer = easing.ease_value_sum_fm
 # Speedup - start 0, end maximum (use with ease in-out or in)
 _summer2 = easing.ease_value_sum
 
 class Particle(BaseSprite):
-    def __init__(self, level, origin, size, 
+    # Without NumPy, particles are updated and drawn one by one (see ParticleList),
+    # otherwise they only carry their initial state into a ParticleSystem
+    def __init__(self, level, origin, size,
                  maxvel_or_dist, length, color, *, angle=0, rotvel=0,
                  ease=easing.ease_quintic_out, from_dist=False,
                  length_disperse=0.3):
@@ -29,6 +40,8 @@ class Particle(BaseSprite):
         self.color, self.angle, self.rotvel = color, angle, rotvel
         self.ease = ease
         self.time = 0
+        # Dead particles are removed by the level after its tick
+        self.alive = True
         self.last_angle = angle
         self.last_size = size
         self.rect = pygame.Rect(0, 0, self.size, self.size)
@@ -48,10 +61,10 @@ class Particle(BaseSprite):
         self.ease_args_y = (self.origin[1], self.dist.y, self.length)
 
     @classmethod
-    def from_sprite(cls, sprite, size, maxvel_or_dist, length, 
+    def from_sprite(cls, sprite, size, maxvel_or_dist, length,
                     color, *, angle=0, rotvel=0, ease=easing.ease_quintic_out, from_dist=False):
         origin = sprite.rect.move(random.randint(-7, 7), random.randint(-7, 7)).center
-        return cls(sprite.level, origin, size, maxvel_or_dist, length, color, 
+        return cls(sprite.level, origin, size, maxvel_or_dist, length, color,
                    angle=angle, rotvel=rotvel, ease=ease, from_dist=from_dist)
 
     def update(self):
@@ -60,7 +73,7 @@ class Particle(BaseSprite):
         if self.time >= self.length:
             self.size -= 0.25
             if self.size <= 0:
-                self.level.particles.remove(self)
+                self.alive = False
                 return
         if self.last_size != self.size and not self.size % 1:
             new_rect = pygame.Rect(0, 0, self.size, self.size)
@@ -75,10 +88,234 @@ class Particle(BaseSprite):
         self.rect.center = (x, y)
 
     def draw(self, screen, pos_fix=(0, 0)):
-        screen.fill(self.color, self.rect.move(pos_fix))        
-        nearby = self.get_tiles_next_to() + [self.closest_tile_index]
-        for col, row in nearby:
-            tile = self.level.layout[row][col]
-            if not tile.transparent and self.rect.colliderect(tile.rect) and \
-               (col, row) not in self.level.redrawn:
-                self.level.redrawn.add((col, row))
\ No newline at end of file
+        screen.fill(self.color, self.rect.move(pos_fix))
+        self.level.mark_overdrawn(self.rect)
+
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+# ===== ===== =====    Particle Containers  ===== ===== =====
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+
+class NullParticles:
+    """
+    Stands in for the particle container of a level while it is
+    fast-forwarded (see BaseLevel.fast_forward), particles are dropped.
+    """
+    def __len__(self):
+        return 0
+
+    def append(self, particle):
+        pass
+
+    def extend(self, particles):
+        pass
+
+    def clear(self):
+        pass
+
+    def update(self):
+        pass
+
+    def draw(self, screen, pos_fix=(0, 0)):
+        pass
+
+def create_particle_container(level):
+    if numpy is None:
+        return ParticleList(level)
+    return ParticleSystem(level)
+
+class ParticleList(list):
+    """
+    Particles of a level as Particle objects.
+    """
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+
+    def update(self):
+        # Dead particles are compacted out in the same pass,
+        # particles spawned during it are kept at the end
+        count = len(self)
+        alive = 0
+        for i in range(count):
+            particle = self[i]
+            particle.update()
+            if particle.alive:
+                self[alive] = particle
+                alive += 1
+        del self[alive:count]
+
+    def draw(self, screen, pos_fix=(0, 0)):
+        fog = self.level.fog_overlay
+        for particle in self:
+            if fog is None or not fog.covers(particle.rect):
+                particle.draw(screen, pos_fix)
+
+class ParticleSystem:
+    """
+    Particles of a level as a structure of NumPy arrays, updated
+    all at once and drawn with a single Surface.blits call.
+    Particle objects appended to it are taken apart into the arrays
+    (at the start of the next update), so they are not updated themselves.
+    Follows the same rules as Particle.update.
+    """
+    initial_capacity = 256
+    fields = (
+        ("x0", "f8"), ("y0", "f8"),   # origin
+        ("dx", "f8"), ("dy", "f8"),   # distance
+        ("x", "f8"), ("y", "f8"),     # current center
+        ("size", "f8"),
+        ("time", "i4"), ("length", "i4"),
+        ("color", "i4"),              # index into colors
+        ("ease", "i4"),               # index into eases
+    )
+    def __init__(self, level):
+        self.level = level
+        self.count = 0
+        self.capacity = self.initial_capacity
+        for name, dtype in self.fields:
+            setattr(self, name, numpy.zeros(self.capacity, dtype))
+        self.pending = []
+        self.colors, self.color_indexes = [], {}
+        self.eases, self.ease_indexes = [], {}
+        # (color index, size) -> surface
+        self.surfaces = {}
+
+    def __len__(self):
+        return self.count + len(self.pending)
+
+    def append(self, particle):
+        self.pending.append(particle)
+
+    def extend(self, particles):
+        self.pending.extend(particles)
+
+    def clear(self):
+        self.count = 0
+        self.pending.clear()
+
+    def get_index(self, value, values, indexes):
+        idx = indexes.get(value)
+        if idx is None:
+            idx = indexes[value] = len(values)
+            values.append(value)
+        return idx
+
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        while self.capacity < count:
+            self.capacity *= 2
+        for name, _ in self.fields:
+            old = getattr(self, name)
+            new = numpy.zeros(self.capacity, old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def flush_pending(self):
+        pending = self.pending
+        if not pending:
+            return
+        start, end = self.count, self.count + len(pending)
+        self.reserve(end)
+        s = slice(start, end)
+        get_index = self.get_index
+        self.x0[s] = self.x[s] = [p.origin[0] for p in pending]
+        self.y0[s] = self.y[s] = [p.origin[1] for p in pending]
+        self.dx[s] = [p.dist.x for p in pending]
+        self.dy[s] = [p.dist.y for p in pending]
+        self.size[s] = [p.size for p in pending]
+        self.time[s] = [p.time for p in pending]
+        self.length[s] = [p.length for p in pending]
+        self.color[s] = [get_index(tuple(p.color), self.colors, self.color_indexes) for p in pending]
+        self.ease[s] = [get_index(p.ease, self.eases, self.ease_indexes) for p in pending]
+        self.count = end
+        pending.clear()
+
+    def compact(self, keep):
+        count = int(keep.sum())
+        for name, _ in self.fields:
+            array = getattr(self, name)
+            array[:count] = array[:self.count][keep]
+        self.count = count
+
+    def update(self):
+        self.flush_pending()
+        n = self.count
+        if not n:
+            return
+        time, length, size = self.time[:n], self.length[:n], self.size[:n]
+        time += 1
+        size -= 0.25 * (time >= length)
+        alive = size > 0
+        if not alive.all():
+            self.compact(alive)
+            n = self.count
+            time, length = self.time[:n], self.length[:n]
+        for idx, ease in enumerate(self.eases):
+            if len(self.eases) == 1:
+                which = slice(0, n)
+            else:
+                which = self.ease[:n] == idx
+            t, total = time[which], length[which]
+            x0, y0 = self.x0[:n][which], self.y0[:n][which]
+            dx, dy = self.dx[:n][which], self.dy[:n][which]
+            array_ease = easing.get_array_version(ease)
+            if array_ease is not None:
+                self.x[:n][which] = array_ease(t, x0, dx, total)
+                self.y[:n][which] = array_ease(t, y0, dy, total)
+            else:
+                # Any other easing, one particle at a time
+                self.x[:n][which] = [ease(*args) for args in zip(t, x0, dx, total)]
+                self.y[:n][which] = [ease(*args) for args in zip(t, y0, dy, total)]
+
+    def get_surface(self, color_idx, size):
+        key = (color_idx, size)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = pygame.Surface((size, size))
+            surface.fill(self.colors[color_idx])
+        return surface
+
+    def draw(self, screen, pos_fix=(0, 0)):
+        n = self.count
+        if not n:
+            return
+        # The rects only shrink when the size reaches a whole number
+        sizes = numpy.ceil(self.size[:n]).astype(int)
+        lefts = self.x[:n].astype(int) - sizes // 2
+        tops = self.y[:n].astype(int) - sizes // 2
+        colors = self.color[:n]
+        fog = self.level.fog_overlay
+        if fog is not None:
+            shown = ~fog.covers_array(lefts, tops, sizes)
+            if not shown.any():
+                return
+            sizes, lefts, tops, colors = sizes[shown], lefts[shown], tops[shown], colors[shown]
+        # One surface per color and size, looked up for all particles at once
+        span = int(sizes.max()) + 1
+        keys, inverse = numpy.unique(colors * span + sizes, return_inverse=True)
+        lookup = numpy.empty(len(keys), object)
+        for i, key in enumerate(keys.tolist()):
+            lookup[i] = self.get_surface(key // span, key % span)
+        positions = zip((lefts + pos_fix[0]).tolist(), (tops + pos_fix[1]).tolist())
+        screen.blits(list(zip(lookup[inverse].tolist(), positions)), False)
+        self.mark_overdrawn(lefts, tops, sizes)
+
+    def mark_overdrawn(self, lefts, tops, sizes):
+        # Occluding tiles under any corner of the particles
+        # are drawn again over them, as in BaseLevel.mark_overdrawn
+        occluders = self.level.occluders
+        if occluders is None or not occluders.rects:
+            return
+        mask = numpy.frombuffer(occluders.mask, numpy.uint8)
+        width, height = occluders.width, occluders.height
+        cols = (lefts // tile_size, (lefts + sizes - 1) // tile_size)
+        rows = (tops // tile_size, (tops + sizes - 1) // tile_size)
+        redrawn = self.level.redrawn
+        for col in cols:
+            for row in rows:
+                inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+                idx = numpy.where(inside, row * width + col, 0)
+                hit = inside & (mask[idx] != 0)
+                if hit.any():
+                    redrawn.update(zip(col[hit].tolist(), row[hit].tolist()))
\ No newline at end of file
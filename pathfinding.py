@@ -1,4 +1,7 @@
 import collections
+import heapq
+import math
+import time
 
 import pygame
 
@@ -41,20 +44,20 @@ def tile_neighbours(col, row):
 # S .
 # . G Diagonal allowed
 # S .
-def tile_neighbours_in_level(col, row, layout):
+# 'grid' is the level's passability grid (levelgrid.TileGrid)
+def tile_neighbours_in_level(col, row, grid):
+    passable = grid.get # Bounds-checked, False outside of the level
     result = tile_neighbours(col, row)
-    result = [p for p in result if layout[p[1]][p[0]].passable]
-    left = layout[row][col - 1].passable if col > 0 else False
-    right = layout[row][col + 1].passable if col < level_size[0] - 1 else False
-    up = layout[row - 1][col].passable if row > 0 else False
-    down = layout[row + 1][col].passable if row < level_size[1] - 1 else False
-    if up and left and layout[row - 1][col - 1].passable:
+    result = [p for p in result if passable(p[0], p[1])]
+    left, right = passable(col - 1, row), passable(col + 1, row)
+    up, down = passable(col, row - 1), passable(col, row + 1)
+    if up and left and passable(col - 1, row - 1):
         result.append((col - 1, row - 1))
-    if down and left and layout[row + 1][col - 1].passable:   
+    if down and left and passable(col - 1, row + 1):
         result.append((col - 1, row + 1))
-    if up and right and layout[row - 1][col + 1].passable:    
+    if up and right and passable(col + 1, row - 1):
         result.append((col + 1, row - 1))
-    if down and right and layout[row + 1][col + 1].passable:  
+    if down and right and passable(col + 1, row + 1):
         result.append((col + 1, row + 1))
     return result
 
@@ -96,7 +99,525 @@ def a_star_reconstruct_path(came_from, current):
         path.append(current)
     return path
 
-def a_star_in_level(start, goal, layout):
+def a_star_in_level(start, goal, grid):
     def get_neighbours(col, row):
-        return tile_neighbours_in_level(col, row, layout)
-    return a_star(start, goal, get_neighbours=get_neighbours)
\ No newline at end of file
+        return tile_neighbours_in_level(col, row, grid)
+    return a_star(start, goal, get_neighbours=get_neighbours)
+
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+# ===== ===== =====      Search on grids    ===== ===== =====
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+
+SQRT2 = math.sqrt(2)
+
+# (dx, dy), in the order of tile_neighbours_in_level
+directions = ((1, 0), (-1, 0), (0, 1), (0, -1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def octile(dx, dy):
+    # Exact distance with straight and diagonal moves only (as utils.dist along a path)
+    dx, dy = abs(dx), abs(dy)
+    return dx + dy + (SQRT2 - 2) * (dx if dx < dy else dy)
+
+def run_steps(steps):
+    # Run a search generator to the end, returning its result
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+class PathGrid:
+    """
+    A passability grid (levelgrid.TileGrid) prepared for searching.
+    Tiles are numbered row-major in a grid with a border of impassable tiles,
+    so moving to a neighbour is adding an offset, without bounds checks.
+    The moves allowed from each tile (same rules as tile_neighbours_in_level)
+    are precomputed as bit masks (a bit for each of directions) and
+    as (neighbour, cost) tuples.
+    """
+    def __init__(self, grid):
+        self.width, self.height = grid.width, grid.height
+        self.stride = stride = grid.width + 2
+        size = stride * (grid.height + 2)
+        self.passable = passable = bytearray(size)
+        for row in range(grid.height):
+            start = (row + 1) * stride + 1
+            passable[start:start + grid.width] = grid.rows[row]
+        self.offsets = [dy * stride + dx for dx, dy in directions]
+        self.masks = bytearray(size)
+        self.neighbours = [()] * size
+        for row in range(grid.height):
+            for col in range(grid.width):
+                idx = self.index(col, row)
+                mask = 0
+                for bit, (dx, dy) in enumerate(directions):
+                    if not passable[idx + dy * stride + dx]:
+                        continue
+                    if dx and dy and not (passable[idx + dx] and passable[idx + dy * stride]):
+                        continue
+                    mask |= 1 << bit
+                self.masks[idx] = mask
+                self.neighbours[idx] = tuple((idx + offset, SQRT2 if bit >= 4 else 1)
+                                             for bit, offset in enumerate(self.offsets)
+                                             if mask >> bit & 1)
+
+    def index(self, col, row):
+        return (row + 1) * self.stride + col + 1
+
+    def tile(self, idx):
+        row, col = divmod(idx, self.stride)
+        return col - 1, row - 1
+
+    def inside(self, col, row):
+        return 0 <= col < self.width and 0 <= row < self.height
+
+    def find_path(self, start, goal, *, jps=False):
+        """
+        Same result as a_star_in_level (a shortest path from goal to start,
+        both included, or an empty list), found with a binary heap.
+        With jps, jump point search is used, which skips over open areas.
+        """
+        return run_steps(self.find_path_steps(start, goal, jps=jps))
+
+    def find_path_steps(self, start, goal, *, jps=False):
+        # find_path as a generator, yielding after every expanded tile
+        # and returning the path (see PathRequestQueue)
+        if not (self.inside(*start) and self.inside(*goal)):
+            return []
+        if start == goal:
+            return [start]
+        if jps:
+            return (yield from self.search_jps(self.index(*start), self.index(*goal)))
+        return (yield from self.search(self.index(*start), self.index(*goal)))
+
+    def search(self, start, goal):
+        stride, neighbours = self.stride, self.neighbours
+        grow, gcol = divmod(goal, stride)
+        g_score = {start: 0}
+        came_from = {}
+        closed = set()
+        heap = [(0, 0, start)]
+        while heap:
+            _, _, current = heapq.heappop(heap)
+            if current == goal:
+                return self.reconstruct(came_from, current)
+            if current in closed:
+                continue
+            closed.add(current)
+            yield
+            base = g_score[current]
+            for neighbour, cost in neighbours[current]:
+                if neighbour in closed:
+                    continue
+                score = base + cost
+                if score < g_score.get(neighbour, math.inf):
+                    g_score[neighbour] = score
+                    came_from[neighbour] = current
+                    row, col = divmod(neighbour, stride)
+                    # Ties go to the node further along (larger g)
+                    heapq.heappush(heap, (score + octile(col - gcol, row - grow), -score, neighbour))
+        return []
+
+    def reconstruct(self, came_from, current):
+        path = [self.tile(current)]
+        while current in came_from:
+            current = came_from[current]
+            path.append(self.tile(current))
+        return path
+
+    # ===== Jump point search =====
+    # Variant for grids where diagonal moves may not cut corners:
+    # straight jumps stop next to obstacles they pass by,
+    # diagonal jumps stop where a straight jump from them would.
+
+    def jump_straight(self, idx, step, side, goal):
+        # Follow a straight line, side is the offset of the direction perpendicular to it
+        passable = self.passable
+        while True:
+            idx += step
+            if not passable[idx]:
+                return None
+            if idx == goal:
+                return idx
+            if (passable[idx + side] and not passable[idx - step + side]) or \
+               (passable[idx - side] and not passable[idx - step - side]):
+                return idx
+
+    def jump(self, idx, dx, dy, goal):
+        stride, passable = self.stride, self.passable
+        if not dx or not dy:
+            if dx:
+                return self.jump_straight(idx, dx, stride, goal)
+            return self.jump_straight(idx, dy * stride, 1, goal)
+        step = dy * stride + dx
+        while True:
+            # A diagonal move needs both straight neighbours to be passable
+            if not (passable[idx + dx] and passable[idx + dy * stride]):
+                return None
+            idx += step
+            if not passable[idx]:
+                return None
+            if idx == goal:
+                return idx
+            if self.jump_straight(idx, dx, stride, goal) is not None or \
+               self.jump_straight(idx, dy * stride, 1, goal) is not None:
+                return idx
+
+    def pruned_directions(self, idx, parent):
+        # Directions worth following from idx when coming from parent
+        mask = self.masks[idx]
+        if parent is None:
+            return [directions[bit] for bit in range(8) if mask >> bit & 1]
+        stride = self.stride
+        prow, pcol = divmod(parent, stride)
+        row, col = divmod(idx, stride)
+        dx = (col > pcol) - (col < pcol)
+        dy = (row > prow) - (row < prow)
+        if dx and dy:
+            candidates = ((dx, 0), (0, dy), (dx, dy))
+        elif dx:
+            candidates = ((dx, 0), (0, 1), (0, -1), (dx, 1), (dx, -1))
+        else:
+            candidates = ((0, dy), (1, 0), (-1, 0), (1, dy), (-1, dy))
+        return [d for d in candidates if mask >> directions.index(d) & 1]
+
+    def search_jps(self, start, goal):
+        stride = self.stride
+        grow, gcol = divmod(goal, stride)
+        g_score = {start: 0}
+        came_from = {}
+        closed = set()
+        heap = [(0, 0, start)]
+        while heap:
+            _, _, current = heapq.heappop(heap)
+            if current == goal:
+                return self.reconstruct_jps(came_from, current)
+            if current in closed:
+                continue
+            closed.add(current)
+            yield
+            base = g_score[current]
+            row, col = divmod(current, stride)
+            for dx, dy in self.pruned_directions(current, came_from.get(current)):
+                point = self.jump(current, dx, dy, goal)
+                if point is None or point in closed:
+                    continue
+                prow, pcol = divmod(point, stride)
+                score = base + octile(pcol - col, prow - row)
+                if score < g_score.get(point, math.inf):
+                    g_score[point] = score
+                    came_from[point] = current
+                    heapq.heappush(heap, (score + octile(pcol - gcol, prow - grow), -score, point))
+        return []
+
+    def reconstruct_jps(self, came_from, current):
+        # Jump points are on straight or diagonal lines, fill in the tiles between them
+        path = [self.tile(current)]
+        stride = self.stride
+        while current in came_from:
+            previous = came_from[current]
+            row, col = divmod(current, stride)
+            prow, pcol = divmod(previous, stride)
+            step = ((prow > row) - (prow < row)) * stride + (pcol > col) - (pcol < col)
+            while current != previous:
+                current += step
+                path.append(self.tile(current))
+        return path
+
+class FlowField:
+    """
+    Distances from every tile of a PathGrid to a goal tile (Dijkstra),
+    and the next tile on a shortest path from each tile towards the goal.
+    Computed once for any number of sprites heading to the same tile,
+    each of them then looks up its next step in constant time.
+    """
+    def __init__(self, path_grid, goal, *, build=True):
+        self.path_grid, self.goal = path_grid, goal
+        size = len(path_grid.passable)
+        self.distances = [math.inf] * size
+        self.next_steps = [-1] * size
+        if build:
+            run_steps(self.build_steps())
+
+    def build_steps(self):
+        # Generator yielding after every expanded tile, returns the field itself
+        path_grid, goal = self.path_grid, self.goal
+        distances, next_steps = self.distances, self.next_steps
+        if not path_grid.inside(*goal):
+            return self
+        passable, neighbours = path_grid.passable, path_grid.neighbours
+        start = path_grid.index(*goal)
+        distances[start] = 0
+        heap = [(0, start)]
+        while heap:
+            distance, current = heapq.heappop(heap)
+            # Tiles can only be entered if they are passable (as in a_star_in_level)
+            if distance > distances[current] or not passable[current]:
+                continue
+            yield
+            for neighbour, cost in neighbours[current]:
+                score = distance + cost
+                if score < distances[neighbour]:
+                    distances[neighbour] = score
+                    next_steps[neighbour] = current
+                    heapq.heappush(heap, (score, neighbour))
+        return self
+
+    def distance(self, col, row):
+        if not self.path_grid.inside(col, row):
+            return math.inf
+        return self.distances[self.path_grid.index(col, row)]
+
+    def next_tile(self, col, row):
+        # None at the goal, or if it can't be reached
+        if not self.path_grid.inside(col, row):
+            return None
+        step = self.next_steps[self.path_grid.index(col, row)]
+        return None if step < 0 else self.path_grid.tile(step)
+
+    def path(self, start):
+        # Same as PathGrid.find_path(start, goal)
+        if start == self.goal:
+            return [start]
+        path = [start]
+        while path[-1] != self.goal:
+            step = self.next_tile(*path[-1])
+            if step is None:
+                return []
+            path.append(step)
+        path.reverse()
+        return path
+
+def path_length(path):
+    return sum(utils.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+# ===== ===== =====      Path requests      ===== ===== =====
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+
+class PathRequest:
+    """
+    Handle of a search submitted to a PathRequestQueue.
+    Once it is done, result holds what the search returned
+    (a path for submit, a FlowField for submit_flow_field).
+    """
+    def __init__(self, steps, callback=None):
+        self.steps = steps
+        self.callback = callback
+        self.done = self.cancelled = False
+        self.result = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        if self.callback is not None:
+            self.callback(result)
+
+
+class PathRequestQueue:
+    """
+    Searches that are run a bit at a time, in the order they were submitted,
+    for at most budget microseconds per run (called once per tick),
+    so that many of them never stall a single frame.
+    The time is checked after every check_every expanded tiles, runs that
+    go over the budget anyway (a slow batch of steps) are counted in overruns.
+    """
+    budget = 1000
+    check_every = 16
+    def __init__(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.requests = collections.deque()
+        self.overruns = 0
+        self.completed = 0
+        self.last_run_time = 0 # Microseconds
+
+    def __len__(self):
+        return len(self.requests)
+
+    def submit_steps(self, steps, callback=None):
+        request = PathRequest(steps, callback)
+        self.requests.append(request)
+        return request
+
+    def submit(self, path_grid, start, goal, *, jps=False, callback=None):
+        # callback(path), called when the path is found
+        return self.submit_steps(path_grid.find_path_steps(start, goal, jps=jps), callback)
+
+    def submit_flow_field(self, path_grid, goal, callback=None):
+        # callback(flow_field), called when the field is complete
+        field = FlowField(path_grid, goal, build=False)
+        return self.submit_steps(field.build_steps(), callback)
+
+    def clear(self):
+        for request in self.requests:
+            request.cancel()
+        self.requests.clear()
+
+    def run(self):
+        if not self.requests:
+            self.last_run_time = 0
+            return
+        start = now = time.perf_counter()
+        deadline = start + self.budget / 10**6
+        requests, check_every = self.requests, self.check_every
+        while requests:
+            request = requests[0]
+            if request.cancelled:
+                requests.popleft()
+                continue
+            steps = request.steps
+            last = now
+            try:
+                for _ in range(check_every):
+                    next(steps)
+            except StopIteration as stop:
+                requests.popleft()
+                self.completed += 1
+                request.finish(stop.value)
+            now = time.perf_counter()
+            # Stop if another batch of steps like this one would not fit
+            if now + (now - last) >= deadline:
+                break
+        self.last_run_time = round((time.perf_counter() - start) * 10**6)
+        if self.last_run_time > self.budget:
+            self.overruns += 1
+
+
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+# ===== ===== =====      Maze (rooms)       ===== ===== =====
+# ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
+
+# Doors by the side of the room they are on, as in BaseLevel.start_entries
+maze_directions = {"left": (-1, 0), "right": (1, 0), "top": (0, -1), "bottom": (0, 1)}
+opposite_maze_directions = {"left": "right", "right": "left", "top": "bottom", "bottom": "top"}
+
+def door_costs(path_grid, doors):
+    """
+    Path lengths between the doors of a room, as {(from, to): cost}, where
+    doors is {direction: (col, row)}. Doors that don't connect are left out.
+    """
+    costs = {}
+    for direction, tile in doors.items():
+        field = FlowField(path_grid, tile)
+        for other, other_tile in doors.items():
+            distance = field.distance(*other_tile)
+            if other != direction and distance < math.inf:
+                costs[other, direction] = distance
+    return costs
+
+class MazeGraph:
+    """
+    Rooms of the maze (GameEngine.vars["map"], level classes by [row][col])
+    connected through their doors. Routes are searched over (room, entry door)
+    nodes, crossing a room costs as much as the path between its two doors
+    in the layout of its level class (BaseLevel.get_door_costs), and going
+    through a door costs one tile. So a route over the whole maze
+    only expands rooms, never the tiles inside them.
+    """
+    def __init__(self, level_map):
+        self.level_map = level_map
+        self.height, self.width = len(level_map), len(level_map[0])
+        # (col, row) -> directions of the doors that lead to another room
+        self.doors = {}
+        for row, level_row in enumerate(level_map):
+            for col, level_cls in enumerate(level_row):
+                if level_cls is not None:
+                    self.doors[col, row] = [direction for direction in maze_directions
+                                            if self.connected(col, row, direction)]
+        # The cheapest crossing of any room, for the heuristic
+        level_classes = set(map(self.get_level, self.doors))
+        self.min_crossing = min((cost for level_cls in level_classes
+                                 for cost in level_cls.get_door_costs().values()), default=0)
+        self.expanded = 0 # by the last search
+
+    def get_level(self, cell):
+        return self.level_map[cell[1]][cell[0]]
+
+    def step(self, cell, direction):
+        dx, dy = maze_directions[direction]
+        return (cell[0] + dx, cell[1] + dy)
+
+    def connected(self, col, row, direction):
+        # Both rooms need a door on their shared side
+        ncol, nrow = self.step((col, row), direction)
+        if not (0 <= ncol < self.width and 0 <= nrow < self.height):
+            return False
+        neighbour = self.level_map[nrow][ncol]
+        return neighbour is not None and \
+               self.level_map[row][col].start_entries[direction] is not None and \
+               neighbour.start_entries[opposite_maze_directions[direction]] is not None
+
+    def rooms_within(self, start, steps):
+        # Rooms reachable from the start room through at most steps doors,
+        # as {room: steps}, the start room included
+        found = {start: 0}
+        frontier = [start]
+        for distance in range(1, steps + 1):
+            next_frontier = []
+            for cell in frontier:
+                for direction in self.doors.get(cell, ()):
+                    neighbour = self.step(cell, direction)
+                    if neighbour not in found:
+                        found[neighbour] = distance
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return found
+
+    def heuristic(self, cell, goal):
+        # Every room on the way has to be entered and all but the last crossed
+        rooms = abs(cell[0] - goal[0]) + abs(cell[1] - goal[1])
+        return rooms + max(rooms - 1, 0) * self.min_crossing
+
+    def find_route(self, start, goal, start_costs):
+        """
+        Doors to take from the start room to reach the goal room, as a list
+        of (room, direction), or None if it can't be reached. start_costs are
+        the costs from the start position to the doors of the start room
+        ({direction: cost}, doors missing from it are not used).
+        """
+        self.expanded = 0
+        if start == goal:
+            return []
+        if start not in self.doors or goal not in self.doors:
+            return None
+        start_node = (start, None)
+        best = {start_node: 0}
+        # node -> (previous node, direction of the door taken)
+        came_from = {start_node: None}
+        counter = 0
+        heap = [(self.heuristic(start, goal), 0, counter, start_node)]
+        while heap:
+            _, g, _, node = heapq.heappop(heap)
+            if g > best[node]:
+                continue
+            cell, entry = node
+            if cell == goal:
+                return self.reconstruct(came_from, node)
+            self.expanded += 1
+            costs = start_costs if entry is None else self.get_level(cell).get_door_costs()
+            for direction in self.doors[cell]:
+                cost = costs.get(direction if entry is None else (entry, direction))
+                if cost is None:
+                    continue
+                next_cell = self.step(cell, direction)
+                next_node = (next_cell, opposite_maze_directions[direction])
+                next_g = g + cost + 1
+                if next_g < best.get(next_node, math.inf):
+                    best[next_node] = next_g
+                    came_from[next_node] = (node, direction)
+                    counter += 1
+                    heapq.heappush(heap, (next_g + self.heuristic(next_cell, goal), next_g, counter, next_node))
+        return None
+
+    def reconstruct(self, came_from, node):
+        route = []
+        while came_from[node] is not None:
+            node, direction = came_from[node]
+            route.append((node[0], direction))
+        route.reverse()
+        return route
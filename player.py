@@ -19,7 +19,9 @@ import easing
 import utils
 import projectiles
 import particles
+import pathfinding
 import statuseffects
+import fovcache
 
 print("Load player")
 
@@ -85,14 +87,21 @@ class PlayerCharacter(BaseSprite):
         self.move_sprint = False
         self.rotation = "right"
         self.going_through_door = False
+        # Doors left to go through to reach a maze cell (see start_auto_travel),
+        # and the tiles to the next one in this level
+        self.travel_route = None
+        self.travel_path = None
         self.crouching = False
         self.use_item = False
         self.cast_spell = False
 
         self.fov_enabled = self.game.vars["enable_fov"]
         if self.fov_enabled:
-            self.computed_fov_map = None
-            self.level_vision = None
+            # Bitset of the tiles seen in this level (see fovcache),
+            # added to whenever the tile or the level's layout changes
+            self.level_vision = 0
+            self.last_fov_key = None
+            self.fog = None # fovcache.FogOverlay, for the current level
 
         self.health_points = self.max_health_points
         self.last_health_points = self.health_points
@@ -127,6 +136,8 @@ class PlayerCharacter(BaseSprite):
         self.moving["down"]  = pressed_keys[controls.Keys.Down]
         self.move_sprint     = pressed_keys[controls.Keys.Sprint]
         self.crouching       = pressed_keys[controls.Keys.Crouch]
+        if self.travel_route is not None and any(self.moving.values()):
+            self.stop_auto_travel()
         item = self.selected_item
         spell = self.selected_spell
         for event in events:
@@ -192,7 +203,7 @@ class PlayerCharacter(BaseSprite):
             self.mana_regen_tick += 1
             current_mana_regen = 0
             if self.mana_regen_tick <= self.mana_regen_args[2]:
-                current_mana_regen += easing.ease_circular_in(self.mana_regen_tick, *self.mana_regen_args)
+                current_mana_regen += easing.ease_from_table(easing.ease_circular_in, self.mana_regen_tick, *self.mana_regen_args)
             else:
                 current_mana_regen += self.mana_regen_args[0] + self.mana_regen_args[1]
             if any(self.moving.values()):
@@ -207,6 +218,8 @@ class PlayerCharacter(BaseSprite):
         self.check_attribute_bounds()
         for widget in self.widgets:
             widget.update()
+        if self.travel_route is not None:
+            self.update_auto_travel()
         self.moving_last = self.moving.copy()
         if not self.crouching:
             self.handle_moving()
@@ -244,11 +257,11 @@ class PlayerCharacter(BaseSprite):
             self.parent_state.queue_state = s
         # FOV
         inside_level = 0 <= pcol < self.level.width and 0 <= prow < self.level.height
-        if self.fov_enabled and inside_level and not self.computed_fov_map[prow][pcol]:
-            fovlib.calculate_fov(self.level.transparency_map, 
-                                 pcol, prow, self.vision_radius,
-                                 dest=self.level_vision)
-            self.computed_fov_map[prow][pcol] = True
+        fov_key = (pcol, prow, self.vision_radius, self.level.layout_version)
+        if self.fov_enabled and inside_level and fov_key != self.last_fov_key:
+            self.level_vision |= self.level.fov_cache.get(pcol, prow, self.vision_radius)
+            self.fog.reveal(self.level_vision)
+            self.last_fov_key = fov_key
         # Hidden rooms
         if ptile.flags.PartOfHiddenRoom and not ptile.uncovered:
             self.explore_room()
@@ -263,11 +276,8 @@ class PlayerCharacter(BaseSprite):
 
     def draw(self, screen, pos_fix=(0, 0), *, dui=True):
         if self.fov_enabled:
-            # Draw black squares in places the player didn't see yet
-            for row in self.level.layout:
-                for tile in row:
-                    if not self.level_vision[tile.row_idx][tile.col_idx]:
-                        screen.fill(Color.Black, tile.rect.move(pos_fix))
+            # Black over the places the player didn't see yet
+            self.fog.draw(screen, pos_fix)
         super().draw(screen, pos_fix)
         if self.selected_item is not None:
             self.selected_item.draw(screen, pos_fix)
@@ -396,8 +406,11 @@ class PlayerCharacter(BaseSprite):
 
     def on_new_level(self):
         if self.fov_enabled:
-            self.computed_fov_map = self.new_empty_level_map()
-            self.level_vision = self.new_empty_level_map()
+            self.level_vision = 0
+            self.last_fov_key = None
+            self.fog = fovcache.FogOverlay(self.level.width, self.level.height)
+            # Sprites fully under it are not drawn
+            self.level.fog_overlay = self.fog
         self.reveal_nearby_map_tiles()
         self.minimap.update_on_new_level()
 
@@ -419,6 +432,70 @@ class PlayerCharacter(BaseSprite):
             if 0 <= ncol < width and 0 <= nrow < height:
                 self.map_reveal[nrow][ncol] = True
 
+    # Auto travel
+
+    def start_auto_travel(self, goal):
+        # Returns False if the maze cell can't be reached
+        grid = self.level.get_path_grid()
+        field = pathfinding.FlowField(grid, self.closest_tile_index)
+        start_costs = {}
+        for direction in pathfinding.maze_directions:
+            door = self.level.start_entries[direction]
+            if door is not None and field.distance(*door) < math.inf:
+                start_costs[direction] = field.distance(*door)
+        start = self.game.vars["player_mazepos"]
+        route = self.game.maze_graph.find_route(start, goal, start_costs)
+        if route is None:
+            return False
+        self.travel_route = route or None
+        self.travel_path = None
+        return True
+
+    def stop_auto_travel(self):
+        self.travel_route = self.travel_path = None
+
+    def update_auto_travel(self):
+        # Moves as if the keys were pressed, to the door of this room
+        # on the route and through it
+        mazepos = self.game.vars["player_mazepos"]
+        route = self.travel_route
+        if route[0][0] != mazepos:
+            # Went through the last door
+            route.pop(0)
+            self.travel_path = None
+            if not route or route[0][0] != mazepos:
+                self.stop_auto_travel()
+                return
+        direction = route[0][1]
+        if self.travel_path is None:
+            door = self.level.start_entries[direction]
+            self.travel_path = self.level.get_path_grid().find_path(self.closest_tile_index, door)
+            if not self.travel_path:
+                self.stop_auto_travel()
+                return
+        # The path goes from the door to the player
+        path = self.travel_path
+        target = self.get_tile_center(path[-1])
+        while self.rect.center == target and len(path) > 1:
+            path.pop()
+            target = self.get_tile_center(path[-1])
+        if self.rect.center == target:
+            key = {"top": "up", "bottom": "down"}.get(direction, direction)
+            self.moving[key] = True
+            return
+        for axis, negative, positive in ((0, "left", "right"), (1, "up", "down")):
+            diff = target[axis] - self.rect.center[axis]
+            if abs(diff) >= self.move_speed:
+                self.moving[positive if diff > 0 else negative] = True
+            elif diff:
+                # Closer than a step, so it would overshoot
+                center = list(self.rect.center)
+                center[axis] = target[axis]
+                self.rect.center = center
+
+    def get_tile_center(self, tile):
+        return (tile[0] * tile_size + tile_size // 2, tile[1] * tile_size + tile_size // 2)
+
     # Level
 
     def explore_room(self):
@@ -443,7 +520,6 @@ class PlayerCharacter(BaseSprite):
                     if 0 <= ncol < width - 1 and 0 <= nrow < height - 1 and tup not in visited:
                         visited.add(tup)
                         queue.appendleft(tup)
-        self.level.force_render_update = True
 
     # Status
     @property
@@ -124,8 +124,8 @@ class Sword(AbstractPlayerItem):
 
     def update(self):
         if self.drawn:
-            for sprite in BaseSprite.get_enemy_sprites_as(True, False, self.player.level):
-                if self.rect.colliderect(sprite.rect) and sprite not in self.hit:
+            for sprite in BaseSprite.get_enemy_sprites_as(True, False, self.player.level, self.rect):
+                if sprite not in self.hit:
                     sprite.take_damage(self.damage_dealt)
                     self.hit.append(sprite)
             self.ticks_left -= 1
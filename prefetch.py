@@ -0,0 +1,103 @@
+import levels
+import pathfinding
+
+print("Load room prefetching")
+
+class PrefetchedRoom:
+    """
+    A level for a maze position, built a step at a time (see step):
+    the level object (from the cache, if the room was visited before),
+    then its layout and sprites (init_level), then its render.
+    """
+    def __init__(self, state, mazepos):
+        col, row = mazepos
+        self.mazepos = mazepos
+        self.level_cls = state.game.vars["map"][row][col]
+        if self.level_cls is None:
+            self.level_cls = levels.EmptyLevel
+        # A room simulated off-screen (see offscreen) is built from its result
+        state.game.offscreen.merge(mazepos)
+        self.cache = state.game.vars["level_caches"].get(mazepos)
+        self.level = None
+        self.done = False
+        # Ticks since the player was last next to the door of the room
+        self.away_ticks = 0
+        self.steps = self.build_steps(state)
+
+    def build_steps(self, state):
+        if self.cache is not None:
+            self.level = self.level_cls.load_from_cache(self.cache)
+        else:
+            self.level = self.level_cls()
+        yield
+        # Loading the cache needs the player, the state that
+        # ends up with the level sets its own parent
+        self.level.parent = state
+        self.level.init_level()
+        yield
+        self.level.prepare_render()
+
+    def step(self):
+        # Returns whether the level is complete
+        if not self.done:
+            try:
+                next(self.steps)
+            except StopIteration:
+                self.done = True
+        return self.done
+
+    def finish(self):
+        while not self.step():
+            pass
+        return self.level
+
+
+class RoomPrefetcher:
+    """
+    Builds the room behind the door the player is next to ahead of time,
+    one step per tick, so that going through the door only has to take
+    the level from here. Rooms are dropped once the player was away
+    from their door for evict_ticks.
+    """
+    evict_ticks = 90
+    def __init__(self, state):
+        self.state = state
+        # maze position -> PrefetchedRoom
+        self.rooms = {}
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get_next_mazepos(self, passage):
+        direction = self.state.level.start_entries_rev.get(passage.index)
+        if direction not in pathfinding.maze_directions:
+            return None
+        dx, dy = pathfinding.maze_directions[direction]
+        col, row = self.state.game.vars["player_mazepos"]
+        width, height = self.state.game.vars["mapsize"]
+        if 0 <= col + dx < width and 0 <= row + dy < height:
+            return (col + dx, row + dy)
+        return None
+
+    def update(self):
+        passage = self.state.player.near_passage
+        target = None if passage is None else self.get_next_mazepos(passage)
+        for mazepos, room in list(self.rooms.items()):
+            if mazepos == target:
+                room.away_ticks = 0
+            else:
+                room.away_ticks += 1
+                if room.away_ticks > self.evict_ticks:
+                    del self.rooms[mazepos]
+        if target is not None:
+            room = self.rooms.get(target)
+            if room is None:
+                room = self.rooms[target] = PrefetchedRoom(self.state, target)
+            room.step()
+
+    def take(self, mazepos):
+        # The PrefetchedRoom (possibly not complete yet), or None
+        return self.rooms.pop(mazepos, None)
+
+    def clear(self):
+        self.rooms.clear()
@@ -4,6 +4,11 @@ from enum import Enum
 
 import pygame
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from colors import Color
 import json_ext as json
 import imglib
@@ -16,6 +21,10 @@ import statuseffects
 
 print("Load projectiles")
 
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+level_surface_size = config["level_surface_size"]
+
 class TickStatus(Enum):
     Ok = 0
     Destroy = 1
@@ -30,6 +39,9 @@ class DestroyReason(Enum):
 class BaseProjectile(BaseSprite):
     hostile = friendly = False
     cachable = False
+    # Straight-line projectiles are moved and collided by the level's ProjectileBatch,
+    # their own update then only takes care of the rest (e.g. animation)
+    batched = False
     surface = None
     size = (30, 30)
     surface = imglib.get_missing_surface(size)
@@ -45,11 +57,16 @@ class BaseProjectile(BaseSprite):
             self.rect = pygame.Rect(self.pos, self.size)
         self.destroy_reason = None
         self.destroyed = False
+        self.batch = None # set by ProjectileBatch
 
     def destroy(self):
         self.level.sprites.remove(self)
         self.destroyed = True
 
+    def set_batch_position(self, x, y, topleft):
+        # Where the ProjectileBatch moved it: (x, y) unrounded, topleft for the rect
+        self.rect.topleft = topleft
+
     def simple_tick(self):
         destroy = False
         if not self.inside_level:
@@ -72,12 +89,20 @@ class BaseProjectile(BaseSprite):
 # Projectile that flies in a given left-right-up-down direction
 class SimpleProjectile(BaseProjectile):
     base_size = base_image = image_r = size_r = None
+    directions = {"left": (-1, 0), "right": (1, 0), "up": (0, -1), "down": (0, 1)}
     def __init__(self, level, pos, *, centerpos=True, rotation):
         self.rotation = rotation
         self.surface, self.size = self.image_r[self.rotation], self.size_r[self.rotation]
         super().__init__(level, pos, centerpos=centerpos)
 
+    def get_batch_state(self):
+        # Position and velocity, as (x, y, velx, vely)
+        dx, dy = self.directions[self.rotation]
+        return self.rect.x, self.rect.y, dx * self.speed, dy * self.speed
+
     def update(self):
+        if self.batch is not None:
+            return
         if self.rotation == "left":
             self.rect.x -= self.speed
         elif self.rotation == "right":
@@ -113,7 +138,17 @@ class OmniProjectile(BaseProjectile):
     def towards(cls, level, pos, target):
         return cls(level, pos, norm_vector=utils.Vector.from_points(target, pos).normalize())        
 
+    def get_batch_state(self):
+        return self.xbuf, self.ybuf, self.velx, self.vely
+
+    def set_batch_position(self, x, y, topleft):
+        # The buffers stay current, for when it leaves the batch
+        self.xbuf, self.ybuf = x, y
+        self.rect.topleft = topleft
+
     def update(self):
+        if self.batch is not None:
+            return
         self.xbuf += self.velx
         self.ybuf += self.vely
         self.rect.x, self.rect.y = self.xbuf, self.ybuf
@@ -153,6 +188,7 @@ class EasedProjectile(BaseProjectile):
 class EtherealSword(SimpleProjectile):
     hostile = False
     friendly = True
+    batched = True
     base_size = (30, 12)
     base_image = imglib.load_image_from_file("images/sl/projectiles/EtherealSword.png", after_scale=base_size)
     image_r = imglib.all_rotations(base_image)
@@ -163,6 +199,7 @@ class EtherealSword(SimpleProjectile):
 class Fireball(OmniProjectile):
     hostile = False
     friendly = True
+    batched = True
     rotating = False
     base_size = (16, 16)
     base_image = imglib.load_image_from_file("images/sl/projectiles/Fireball.png", after_scale=base_size)
@@ -206,13 +243,12 @@ class Fireball(OmniProjectile):
             p = particles.Particle.from_sprite(source_sprite, 4, vel, 30, color)
             self.level.particles.append(p)
         # AOE Damage
-        for sprite in self.get_local_enemy_sprites():
-            if utils.dist(self.rect.center, sprite.rect.center) < self.aoe:
-                sprite.take_damage(self.damage_aoe)
-                if random.uniform(0, 1) <= self.aoe_effect_chance:
-                    tick = self.level.parent.game.ticks
-                    effect = self.caused_effect(sprite, tick, self.effect_length)
-                    sprite.status_effects.add(effect)
+        for sprite in self.get_local_enemy_sprites(center=self.rect.center, radius=self.aoe):
+            sprite.take_damage(self.damage_aoe)
+            if random.uniform(0, 1) <= self.aoe_effect_chance:
+                tick = self.level.parent.game.ticks
+                effect = self.caused_effect(sprite, tick, self.effect_length)
+                sprite.status_effects.add(effect)
 
     def deal_damage(self, sprite):
         super().deal_damage(sprite)
@@ -278,8 +314,8 @@ class FlyingBoomerang(OmniProjectile):
         self.surface = imglib.rotate(self.base_image, self.rotation)
         new_rect = self.surface.get_rect(); new_rect.center = self.rect.center
         self.rect = new_rect
-        for sprite in self.get_local_enemy_sprites():
-            if sprite not in self.hit and self.rect.colliderect(sprite.rect):
+        for sprite in self.get_local_enemy_sprites(self.rect):
+            if sprite not in self.hit:
                 self.hit.add(sprite)
                 sprite.take_damage(self.act_damage)
                 self.act_damage *= self.damage_loss_mul
@@ -353,10 +389,209 @@ class Arrow(OmniProjectile):
     rotating = True
     hostile = True
     friendly = False
+    batched = True
     base_size = (15, 3)
     base_image = imglib.load_image_from_file("images/sl/projectiles/Arrow.png", after_scale=base_size)
     speed = 10
     damage = 0.5
 
 
+# Batch
+
+def create_projectile_batch(level):
+    if numpy is None:
+        return None
+    return ProjectileBatch(level)
+
+def _round_half_away(array):
+    # How pygame rounds floats assigned to rect attributes
+    return numpy.trunc(array + numpy.copysign(0.5, array)).astype(int)
+
+class ProjectileBatch:
+    """
+    Batched projectiles (see BaseProjectile.batched) of a level as NumPy arrays.
+    Kept in sync with the sprites of the level as an index of its SpriteContainer.
+    Every tick all of them are moved at once and tested against the edges of
+    the level, the passability grid and (in a single pass) the enemy sprites.
+    Only the projectiles that are destroyed get their deal_damage and destroy
+    called, in the same order as BaseProjectile.simple_tick would.
+    """
+    initial_capacity = 64
+    fields = (
+        ("x", "f8"), ("y", "f8"),     # topleft
+        ("velx", "f8"), ("vely", "f8"),
+        ("w", "i4"), ("h", "i4"),
+        ("side", "i4"),               # friendly | hostile << 1
+        ("alive", "?"),
+    )
+    def __init__(self, level):
+        self.level = level
+        self.count = 0
+        self.capacity = self.initial_capacity
+        for name, dtype in self.fields:
+            setattr(self, name, numpy.zeros(self.capacity, dtype))
+        self.sprites = []
+        self.indexes = {} # sprite -> position in the arrays
+        self.pending = []
+        self.removed = 0
+        self.target_sprites = []
+
+    def __len__(self):
+        return self.count - self.removed + len(self.pending)
+
+    def __contains__(self, sprite):
+        return isinstance(sprite, BaseProjectile) and sprite.batch is self
+
+    # ===== Index =====
+
+    def add(self, sprite):
+        if isinstance(sprite, BaseProjectile) and sprite.batched and sprite.batch is None:
+            sprite.batch = self
+            self.pending.append(sprite)
+
+    def discard(self, sprite):
+        if sprite not in self:
+            return
+        sprite.batch = None
+        idx = self.indexes.pop(sprite, None)
+        if idx is None:
+            self.pending.remove(sprite)
+        else:
+            self.alive[idx] = False
+            self.removed += 1
+
+    def clear(self):
+        for sprite in self.indexes:
+            sprite.batch = None
+        for sprite in self.pending:
+            sprite.batch = None
+        self.count = self.removed = 0
+        self.sprites.clear()
+        self.indexes.clear()
+        self.pending.clear()
+
+    # ===== Storage =====
+
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        while self.capacity < count:
+            self.capacity *= 2
+        for name, _ in self.fields:
+            old = getattr(self, name)
+            new = numpy.zeros(self.capacity, old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def compact(self):
+        if not self.removed:
+            return
+        keep = self.alive[:self.count].copy()
+        count = int(keep.sum())
+        for name, _ in self.fields:
+            array = getattr(self, name)
+            array[:count] = array[:self.count][keep]
+        self.sprites = [sprite for sprite, alive in zip(self.sprites, keep.tolist()) if alive]
+        self.indexes = {sprite: i for i, sprite in enumerate(self.sprites)}
+        self.count = count
+        self.removed = 0
+
+    def flush_pending(self):
+        pending = self.pending
+        if not pending:
+            return
+        start, end = self.count, self.count + len(pending)
+        self.reserve(end)
+        s = slice(start, end)
+        states = [sprite.get_batch_state() for sprite in pending]
+        self.x[s], self.y[s], self.velx[s], self.vely[s] = zip(*states)
+        self.w[s] = [sprite.rect.w for sprite in pending]
+        self.h[s] = [sprite.rect.h for sprite in pending]
+        self.side[s] = [bool(sprite.friendly) | bool(sprite.hostile) << 1 for sprite in pending]
+        self.alive[s] = True
+        for i, sprite in enumerate(pending, start):
+            self.indexes[sprite] = i
+        self.sprites.extend(pending)
+        self.count = end
+        pending.clear()
+
+    # ===== Simulation =====
+
+    def update(self):
+        self.compact()
+        self.flush_pending()
+        n = self.count
+        if not n:
+            return
+        x, y = self.x[:n], self.y[:n]
+        x += self.velx[:n]
+        y += self.vely[:n]
+        left, top = _round_half_away(x), _round_half_away(y)
+        right, bottom = left + self.w[:n], top + self.h[:n]
+        for sprite, bx, by, pos in zip(self.sprites, x.tolist(), y.tolist(), zip(left.tolist(), top.tolist())):
+            sprite.set_batch_position(bx, by, pos)
+        # Same order of checks as BaseProjectile.simple_tick
+        inside = (left < level_surface_size[0]) & (right > 0) & \
+                 (top < level_surface_size[1]) & (bottom > 0)
+        collision = inside & self.get_collisions(left, top, right, bottom)
+        targets = self.get_targets(inside & ~collision, left, top, right, bottom)
+        destroyed = numpy.flatnonzero(~inside | collision | (targets >= 0))
+        if not len(destroyed):
+            return
+        sprites = self.sprites
+        outside, collision, targets = (~inside).tolist(), collision.tolist(), targets.tolist()
+        for i in destroyed.tolist():
+            sprite = sprites[i]
+            if sprite.batch is not self:
+                # Removed by the hooks of another projectile
+                continue
+            if outside[i]:
+                sprite.destroy_reason = DestroyReason.OutsideLevel
+            elif collision[i]:
+                sprite.destroy_reason = DestroyReason.Collision
+            else:
+                sprite.destroy_reason = DestroyReason.DamageDeal
+                sprite.deal_damage(self.target_sprites[targets[i]])
+            sprite.destroy()
+
+    def get_collisions(self, left, top, right, bottom):
+        # Same as BaseSprite.get_collision_nearby for rects no larger than a tile:
+        # the closest tile, or any tile under a corner, is impassable
+        grid = self.level.passable_grid
+        passable, width, height = grid.array, grid.width, grid.height
+        col = numpy.clip((left + right) // 2 // tile_size, 0, width - 1)
+        row = numpy.clip((top + bottom) // 2 // tile_size, 0, height - 1)
+        result = passable[row, col] == 0
+        for col in (left // tile_size, (right - 1) // tile_size):
+            for row in (top // tile_size, (bottom - 1) // tile_size):
+                inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+                result |= inside & (passable[numpy.where(inside, row, 0),
+                                             numpy.where(inside, col, 0)] == 0)
+        return result
+
+    def get_targets(self, candidates, left, top, right, bottom):
+        # Index into target_sprites of the first enemy sprite each projectile hits,
+        # or -1. The enemies are gathered once per side, not per projectile.
+        n = self.count
+        result = numpy.full(n, -1)
+        self.target_sprites = []
+        side = self.side[:n]
+        for key in numpy.unique(side[candidates]).tolist():
+            which = numpy.flatnonzero(candidates & (side == key))
+            enemies = BaseSprite.get_enemy_sprites_as(key & 1, key & 2, self.level)
+            if not enemies:
+                continue
+            rects = numpy.array([tuple(sprite.rect) for sprite in enemies]).reshape(-1, 4)
+            eleft, etop, ewidth, eheight = rects.T
+            eright, ebottom = eleft + ewidth, etop + eheight
+            # pygame.Rect.colliderect, every projectile against every enemy
+            hits = (left[which, None] < eright) & (eleft < right[which, None]) & \
+                   (top[which, None] < ebottom) & (etop < bottom[which, None]) & \
+                   (ewidth > 0) & (eheight > 0)
+            hit = hits.any(axis=1)
+            result[which[hit]] = hits[hit].argmax(axis=1) + len(self.target_sprites)
+            self.target_sprites.extend(enemies)
+        return result
+
+
 register = utils.Register.gather_type(BaseProjectile, locals())
\ No newline at end of file
@@ -0,0 +1,121 @@
+import math
+
+import json_ext as json
+
+print("Load raycasting")
+
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
+# Crossings closer than this (in parts of the segment) are at the same corner,
+# so that rounding errors don't make rays depend on their direction
+epsilon = 1e-9
+
+def traverse(start, end):
+    """
+    Tiles crossed by the segment from start to end (pixel positions), in order,
+    as (col, row, t) where t is the part of the segment (0 to 1) at which it enters
+    the tile. Exact grid traversal (Amanatides & Woo): a segment going through
+    a corner of a tile crosses both tiles next to it too.
+    """
+    x0, y0 = start[0] / tile_size, start[1] / tile_size
+    x1, y1 = end[0] / tile_size, end[1] / tile_size
+    col, row = math.floor(x0), math.floor(y0)
+    dx, dy = x1 - x0, y1 - y0
+    step_col = 1 if dx > 0 else -1
+    step_row = 1 if dy > 0 else -1
+    if dx:
+        tdelta_x = abs(1 / dx)
+        tmax_x = ((col + (dx > 0)) - x0) / dx
+    else:
+        tdelta_x = tmax_x = math.inf
+    if dy:
+        tdelta_y = abs(1 / dy)
+        tmax_y = ((row + (dy > 0)) - y0) / dy
+    else:
+        tdelta_y = tmax_y = math.inf
+    yield col, row, 0
+    while True:
+        t = min(tmax_x, tmax_y)
+        if t > 1:
+            return
+        if tmax_x < tmax_y - epsilon:
+            col += step_col
+            tmax_x += tdelta_x
+        elif tmax_y < tmax_x - epsilon:
+            row += step_row
+            tmax_y += tdelta_y
+        else:
+            yield col + step_col, row, t
+            yield col, row + step_row, t
+            col += step_col; row += step_row
+            tmax_x += tdelta_x; tmax_y += tdelta_y
+        yield col, row, t
+
+def cast_segment(grid, start, end):
+    """
+    Follow the segment from start to end (pixel positions) over a passability grid
+    (levelgrid.TileGrid). Returns the first impassable tile (col, row) and the distance
+    to it, or None and the length of the segment. Outside of the grid is impassable.
+    """
+    length = math.hypot(end[0] - start[0], end[1] - start[1])
+    data, width, height = grid.data, grid.width, grid.height
+    for col, row, t in traverse(start, end):
+        if not (0 <= col < width and 0 <= row < height and data[row * width + col]):
+            return (col, row), t * length
+    return None, length
+
+def cast_ray(grid, origin, direction, max_distance):
+    # direction is a normalized utils.Vector (or an (x, y) pair)
+    end = (origin[0] + direction[0] * max_distance, origin[1] + direction[1] * max_distance)
+    return cast_segment(grid, origin, end)
+
+def tile_center(tile):
+    return ((tile[0] + 0.5) * tile_size, (tile[1] + 0.5) * tile_size)
+
+def tile_line_of_sight(grid, from_tile, to_tile):
+    # Between the centers of the tiles
+    return cast_segment(grid, tile_center(from_tile), tile_center(to_tile))[0] is None
+
+def tile_ray_tiles(from_tile, to_tile):
+    # Tiles crossed between the centers of the tiles (e.g. to show them)
+    seen = {}
+    for col, row, _ in traverse(tile_center(from_tile), tile_center(to_tile)):
+        seen[col, row] = None
+    return list(seen)
+
+
+class LineOfSightCache:
+    """
+    Results of tile_line_of_sight for a level, keyed by the pair of tiles
+    and the layout_version of the level, so that the entries are thrown
+    away once a tile changes (e.g. a hidden room is uncovered).
+    """
+    max_size = 4096
+    def __init__(self, level):
+        self.level = level
+        self.cache = {}
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def clear(self):
+        self.cache.clear()
+
+    def get(self, from_tile, to_tile):
+        # Line of sight is symmetric
+        if to_tile < from_tile:
+            from_tile, to_tile = to_tile, from_tile
+        version = self.level.layout_version
+        key = (from_tile, to_tile, version)
+        result = self.cache.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        if len(self.cache) >= self.max_size or \
+          (self.cache and next(iter(self.cache))[2] != version):
+            self.cache.clear()
+        result = self.cache[key] = tile_line_of_sight(self.level.passable_grid, from_tile, to_tile)
+        return result
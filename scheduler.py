@@ -0,0 +1,98 @@
+import json_ext as json
+
+print("Load entity scheduler")
+
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
+# Level of detail tiers, by the distance to the player
+NEAR, MID, FAR = 0, 1, 2
+
+class EntityScheduler:
+    """
+    Decides which sprites of a level update during a tick, and which of them
+    "think" (take their expensive decisions, see BaseEnemy.think_intervals).
+    Sprites closer to the player think every tick, further away less often,
+    and idle ones out of sight may sleep (not update at all). Every sprite
+    gets its own phase, so sprites with the same interval think on different
+    ticks. Kept as an index of the level's sprites.
+    Out of sight is under the fog of war: without FOV the whole level
+    is drawn, so sprites only ever sleep with FOV on.
+    Sprites without think_intervals are always updated. While a level
+    is fast-forwarded (coarse), every sprite is treated as far away
+    and is only updated when it thinks (see elapsed_ticks), none sleep,
+    so that the level catches up on what happened in it.
+    """
+    near_distance = 6 * tile_size
+    far_distance = 14 * tile_size
+    def __init__(self, level):
+        self.level = level
+        self.tick = 0
+        # sprite -> [phase, tick of the last think, tick of the last update]
+        self.phases = {}
+        self.next_phase = 0
+        self.player_center = None
+        self.fog = None
+        self.coarse = False
+        # Counted over the last tick
+        self.thinking = self.sleeping = 0
+
+    def __len__(self):
+        return len(self.phases)
+
+    def add(self, sprite):
+        if getattr(sprite, "think_intervals", None) is not None and sprite not in self.phases:
+            self.phases[sprite] = [self.next_phase, self.tick, self.tick]
+            self.next_phase += 1
+
+    def discard(self, sprite):
+        self.phases.pop(sprite, None)
+
+    def clear(self):
+        self.phases.clear()
+
+    def begin_tick(self):
+        self.tick += 1
+        self.thinking = self.sleeping = 0
+        parent = self.level.parent
+        player = None if parent is None else parent.player
+        self.player_center = None if player is None else player.rect.center
+        self.fog = self.level.fog_overlay
+
+    def get_tier(self, sprite):
+        if self.player_center is None:
+            return NEAR
+        x, y = sprite.rect.center
+        px, py = self.player_center
+        dsq = (x - px) ** 2 + (y - py) ** 2
+        if dsq < self.near_distance ** 2:
+            return NEAR
+        elif dsq < self.far_distance ** 2:
+            return MID
+        return FAR
+
+    def schedule(self, sprite):
+        # Whether the sprite should be updated this tick. Sets think_this_tick,
+        # think_ticks (ticks since its last think) and elapsed_ticks (since
+        # its last update), both up to its longest interval
+        entry = self.phases.get(sprite)
+        if entry is None:
+            return True
+        tier = FAR if self.coarse else self.get_tier(sprite)
+        if tier == FAR and not self.coarse and sprite.sleeps_when_idle and sprite.is_idle() and \
+          self.fog is not None and self.fog.covers(sprite.rect):
+            self.sleeping += 1
+            return False
+        interval = sprite.think_intervals[tier]
+        phase, last_think, last_update = entry
+        longest = max(sprite.think_intervals)
+        sprite.think_this_tick = interval <= 1 or (self.tick + phase) % interval == 0
+        if sprite.think_this_tick:
+            sprite.think_ticks = min(self.tick - last_think, longest)
+            entry[1] = self.tick
+            self.thinking += 1
+        elif self.coarse:
+            return False
+        sprite.elapsed_ticks = min(self.tick - last_update, longest)
+        entry[2] = self.tick
+        return True
@@ -0,0 +1,138 @@
+import json_ext as json
+
+print("Load spatial hash")
+
+config = json.loadf("configs/dungeon.json")
+tile_size = config["tile_size"]
+
+def faction_filter(sprite, faction):
+    if faction is None:
+        return True
+    elif faction == "hostile":
+        return sprite.hostile
+    elif faction == "friendly":
+        return sprite.friendly
+    elif faction == "passive":
+        return sprite.hostile is sprite.friendly is False
+    else:
+        raise ValueError("Unknown faction: {}".format(faction))
+
+class SpatialHash:
+    """
+    Uniform grid of tile-sized cells, each holding the sprites
+    whose rects overlap it. Used to answer "what is near this rect"
+    queries without walking every sprite of the level.
+    Cells are keyed by (col, row), so sprites outside of
+    the level (e.g. leaving projectiles) are handled too.
+    """
+    def __init__(self, cell_size=tile_size):
+        self.cell_size = cell_size
+        # (col, row) -> {sprite: None}, dicts are used as ordered sets
+        # so that queries return sprites in the order they were added
+        self.cells = {}
+        # sprite -> (first col, first row, last col, last row)
+        self.sprite_bounds = {}
+
+    def __len__(self):
+        return len(self.sprite_bounds)
+
+    def __contains__(self, sprite):
+        return sprite in self.sprite_bounds
+
+    def get_bounds(self, rect):
+        cs = self.cell_size
+        c0, r0 = rect.left // cs, rect.top // cs
+        c1, r1 = (rect.right - 1) // cs, (rect.bottom - 1) // cs
+        # Empty rects still occupy the cell they are in
+        if c1 < c0: c1 = c0
+        if r1 < r0: r1 = r0
+        # Note: pygame_sdl2 uses float for rects, so we need a cast
+        return int(c0), int(r0), int(c1), int(r1)
+
+    def add(self, sprite):
+        if sprite in self.sprite_bounds:
+            self.discard(sprite)
+        bounds = self.get_bounds(sprite.rect)
+        self.sprite_bounds[sprite] = bounds
+        self._link(sprite, bounds)
+
+    def discard(self, sprite):
+        bounds = self.sprite_bounds.pop(sprite, None)
+        if bounds is not None:
+            self._unlink(sprite, bounds)
+
+    def clear(self):
+        self.cells.clear()
+        self.sprite_bounds.clear()
+
+    def update(self, sprite):
+        # Called after a sprite had a chance to move,
+        # relinks it only if it crossed a cell boundary
+        bounds = self.sprite_bounds.get(sprite)
+        if bounds is None:
+            return
+        new_bounds = self.get_bounds(sprite.rect)
+        if new_bounds != bounds:
+            self._unlink(sprite, bounds)
+            self.sprite_bounds[sprite] = new_bounds
+            self._link(sprite, new_bounds)
+
+    def _link(self, sprite, bounds):
+        c0, r0, c1, r1 = bounds
+        cells = self.cells
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                cell = cells.get((col, row))
+                if cell is None:
+                    cell = cells[col, row] = {}
+                cell[sprite] = None
+
+    def _unlink(self, sprite, bounds):
+        c0, r0, c1, r1 = bounds
+        cells = self.cells
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                cell = cells[col, row]
+                del cell[sprite]
+                if not cell:
+                    del cells[col, row]
+
+    def _candidates(self, bounds):
+        c0, r0, c1, r1 = bounds
+        cells = self.cells
+        if c0 == c1 and r0 == r1:
+            return cells.get((c0, r0), ())
+        result = {}
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                cell = cells.get((col, row))
+                if cell:
+                    result.update(cell)
+        return result
+
+    # ===== Queries =====
+
+    def query_rect(self, rect, faction=None):
+        return [sprite for sprite in self._candidates(self.get_bounds(rect))
+                if faction_filter(sprite, faction) and rect.colliderect(sprite.rect)]
+
+    def query_radius(self, center, radius, faction=None):
+        # Measured between the centers of sprites, as the AOE effects do
+        cs = self.cell_size
+        x, y = center
+        # A sprite is always linked to the cell its center is in
+        bounds = (int((x - radius) // cs), int((y - radius) // cs),
+                  int((x + radius) // cs), int((y + radius) // cs))
+        rsq = radius * radius
+        result = []
+        for sprite in self._candidates(bounds):
+            if not faction_filter(sprite, faction):
+                continue
+            sx, sy = sprite.rect.center
+            if (sx - x) ** 2 + (sy - y) ** 2 < rsq:
+                result.append(sprite)
+        return result
+
+    def query_cell(self, col, row, faction=None):
+        return [sprite for sprite in self.cells.get((col, row), ())
+                if faction_filter(sprite, faction)]
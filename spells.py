@@ -7,13 +7,18 @@ from abc_spell import AbstractSpell
 from basesprite import BaseSprite
 from colors import Color
 import imglib
+import json_ext as json
 import utils
 import projectiles
 import particles
+import raycast
 import statuseffects
 
 print("Load spells")
 
+config = json.loadf("configs/dungeon.json")
+level_surface_size = config["level_surface_size"]
+
 base_icon_size = (32, 32)
 
 # Check if the caster has enough mana,
@@ -126,9 +131,8 @@ class PoisonRune(AbstractSpell):
                 for i in range(random.randint(4, 7)):
                     p = particles.Particle.from_sprite(self, 4, utils.Vector.uniform(3), 50, Color.Green)
                     self.level.particles.append(p)
-                for sprite in self.level.hostile_sprites:
-                    if utils.dist(self.rect.center, sprite.rect.center) < self.aoe:
-                        sprite.take_damage(self.damage_aoe)
+                for sprite in self.level.spatial_hash.query_radius(self.rect.center, self.aoe, "hostile"):
+                    sprite.take_damage(self.damage_aoe)
 
     @requires_mana(mana_cost)
     def cast(self):
@@ -146,72 +150,134 @@ class IceBeam(ChanneledSpell):
 
     cooldown = 1
 
-    # If it works, it ain't broken.
-    class BeamProjectile(projectiles.OmniProjectile):
-        rotating = True
+    # The whole beam is a single sprite, cast as a ray from the caster every tick
+    class Beam(projectiles.BaseProjectile):
         hostile = False
         friendly = True
         base_size = (10, 5)
         base_image = imglib.load_image_from_file("images/sl/projectiles/BeamBlue.png", after_scale=base_size)
-        speed = base_size[0] - 1
-        damage = 0.003
+        size = base_size
+        step = base_size[0] - 1 # Between the images the beam is drawn with
+        max_length = math.hypot(*level_surface_size)
+        damage = 0.003 # For each hit, see aim
+        max_hits = 1
+        charged_max_hits = 3
         particle_chance = 1 / 4
         particle_spread = 30
         particle_speed = 2
-        charged_particle_chance = 1 / 100
+        charged_particle_chance = 1 / 100 # For each image
         caused_effect = statuseffects.Chilled
         effect_length = 120
-        def __init__(self, level, pos, *, centerpos=True, norm_vector, charged=True, retain=lambda: True, reason=None):
-            super().__init__(level, pos, centerpos=centerpos, norm_vector=norm_vector)
-            self.charged = charged
+        def __init__(self, level, pos, *, norm_vector, charged=True, retain=lambda: True):
+            super().__init__(level, pos)
             self.retain = retain
-            self.reason = reason
-            self.moving = True
-            # Used to make the beam go deeper into the wall after collision
-            self.destroy_on_next = False
+            self.norm_vector = norm_vector
+            self.charged = charged
+            self.length = 0
+            self.end = pos
+            self.hits = []
+            # Times each hit enemy is hurt per tick
+            self.hit_counts = []
+            self.reason = None
+            self.blit_key = None
+            self.blit_sequence = []
+            self.aim(pos, norm_vector, charged)
+
+        def aim(self, pos, norm_vector, charged):
+            self.pos, self.norm_vector, self.charged = pos, norm_vector, charged
+            grid = self.level.passable_grid
+            tile, length = raycast.cast_ray(grid, pos, norm_vector, self.max_length)
+            self.reason = None
+            if tile is not None and grid.inside(*tile):
+                # Make the beam go a bit into the wall
+                length += self.step
+                self.reason = projectiles.DestroyReason.Collision
+            # Enemies under the images of the beam, closest first
+            rects = self.get_image_rects(pos, norm_vector, int(length // self.step) + 1)
+            found = []
+            for sprite in self.get_local_enemy_sprites(rects[0].union(rects[-1])):
+                images = sprite.rect.collidelistall(rects)
+                if images:
+                    found.append((images, sprite))
+            found.sort(key=lambda pair: pair[0][0])
+            max_hits = self.charged_max_hits if charged else self.max_hits
+            found = found[:max_hits]
+            if len(found) == max_hits:
+                # Stopped by the last enemy hit, at the first image over it
+                length = min(length, found[-1][0][0] * self.step)
+                self.reason = projectiles.DestroyReason.DamageDeal
+            self.hits = [sprite for _, sprite in found]
+            # As when the beam was made of projectiles, rebuilt every tick it touched
+            # an enemy: the one that reached the enemy hurt it, then every one over it
+            last = int(length // self.step)
+            self.hit_counts = [1 + sum(1 for i in images if i <= last) for images, _ in found]
+            if self.hits:
+                self.last_attacked_sprite = self.hits[-1]
+            self.length = length
+            self.end = (pos[0] + norm_vector[0] * length, pos[1] + norm_vector[1] * length)
+            self.update_blits()
+
+        def get_surface(self, norm_vector):
+            return imglib.rotate(self.base_image, -int(norm_vector.to_angle()))
+
+        def get_image_rects(self, pos, norm_vector, count):
+            # Where the first count images of the beam are drawn
+            w, h = self.get_surface(norm_vector).get_size()
+            (x, y), (vx, vy) = pos, norm_vector * self.step
+            return [pygame.Rect(round(x + vx * i - w / 2), round(y + vy * i - h / 2), w, h)
+                    for i in range(count)]
+
+        def update_blits(self):
+            # The beam image repeated along the ray, rebuilt only when the beam changes
+            count = int(self.length // self.step) + 1
+            key = (tuple(self.pos), tuple(self.norm_vector), count)
+            if key == self.blit_key:
+                return
+            self.blit_key = key
+            surface = self.get_surface(self.norm_vector)
+            self.blit_sequence = [(surface, rect) for rect in self.get_image_rects(self.pos, self.norm_vector, count)]
+            self.rect = self.blit_sequence[0][1].union(self.blit_sequence[-1][1])
+
         def update(self):
-            if self.moving:
-                self.xbuf += self.velx
-                self.ybuf += self.vely
-                self.rect.x, self.rect.y = self.xbuf, self.ybuf
-            else:
-                self.simple_deal_damage()
-            if self.reason is None:        
-                if self.charged and random.uniform(0, 1) <= self.charged_particle_chance:
-                    p = particles.Particle.from_sprite(self, 3, utils.Vector.uniform(1), 50, Color.lBlue)
+            for sprite, count in zip(self.hits, self.hit_counts):
+                self.deal_damage(sprite, count)
+            count = len(self.blit_sequence)
+            if self.charged and random.uniform(0, 1) <= self.charged_particle_chance * count:
+                rect = random.choice(self.blit_sequence)[1]
+                self.add_particle(rect.center, 3, utils.Vector.uniform(1), 50)
+            if self.reason == projectiles.DestroyReason.Collision and random.uniform(0, 1) <= self.particle_chance:
+                vel = utils.Vector.random_spread(self.norm_vector, self.particle_spread).opposite() * self.particle_speed
+                self.add_particle(self.end, 4, vel, 40)
+            for sprite in self.hits:
+                if random.uniform(0, 1) <= self.particle_chance:
+                    p = particles.Particle.from_sprite(sprite, 4, utils.Vector.uniform(self.particle_speed), 40, Color.lBlue)
                     self.level.particles.append(p)
-            elif random.uniform(0, 1) <= self.particle_chance:
-                norm = self.norm_vector
-                spread = self.particle_spread
-                source_sprite = self
-                if self.reason == projectiles.DestroyReason.Collision:
-                    vel = utils.Vector.random_spread(norm, spread).opposite() * self.particle_speed
-                elif self.reason == projectiles.DestroyReason.DamageDeal:
-                    vel = utils.Vector.uniform(self.particle_speed)
-                    source_sprite = self.last_attacked_sprite
-                else:
-                    vel = utils.Vector(0, 0)
-                p = particles.Particle.from_sprite(source_sprite, 4, vel, 40, Color.lBlue)
-                self.level.particles.append(p)
+
+        def add_particle(self, pos, size, vel, length):
+            origin = (pos[0] + random.randint(-7, 7), pos[1] + random.randint(-7, 7))
+            self.level.particles.append(particles.Particle(self.level, origin, size, vel, length, Color.lBlue))
+
         def draw(self, screen, pos_fix=(0, 0)):
-            super().draw(screen, pos_fix)            
+            if pos_fix == (0, 0):
+                screen.blits(self.blit_sequence, False)
+            else:
+                screen.blits([(surface, rect.move(pos_fix)) for surface, rect in self.blit_sequence], False)
+            self.is_overdrawn = self.level.mark_overdrawn(self.rect)
             if not self.retain():
                 self.destroy()
-        def deal_damage(self, sprite):
-            super().deal_damage(sprite)
+
+        def deal_damage(self, sprite, count=1):
+            sprite.take_damage(self.damage * count)
+            self.last_attacked_sprite = sprite
             tick = self.level.parent.game.ticks
             eff = self.caused_effect(sprite, tick, self.effect_length)
             sprite.status_effects.add(eff)
 
     def __init__(self, player):
         super().__init__(player)
-        self.next_beam = self.cooldown
         self.stationary_time = 0
         self.last_tick_cast = -1
-        self.last_vec = None
-        self.last_pos = None
-        self.last_col = False
-        self.beams = []
+        self.beam = None
 
     @requires_channel_mana(mana_channel_cost)
     def cast(self):
@@ -222,94 +288,14 @@ class IceBeam(ChanneledSpell):
             self.stationary_time += 1
         else:
             self.stationary_time = 0
-        
-        dest = False
-        col = False
-        any_beam = None
-        ens = []
-        if self.beams:
-            any_beam = self.beams[0]
-            ens = any_beam.get_local_enemy_sprites() 
-        if self.beams and not any_beam in self.player.level.sprites:
-            dest = True
-        if not dest and self.last_vec != vec or self.last_pos != pos:
-            dest = True
-        if not dest and self.beams and ens:
-            for b in self.beams:
-                for e in ens:
-                    if b.rect.colliderect(e.rect):
-                        dest = True
-                        col = True
-                        break
-                else:
-                    continue
-                break
-        if not dest and not col and self.last_col:
-            dest = True
-        if not dest and self.stationary_time >= 60 and not self.last_charged:
-            dest = True
-        if dest:
-            self.destroy_beams()
-        self.repopulate_beams()
-        
+        charged = self.stationary_time >= 60
+        if self.beam is None or self.beam not in level.sprites:
+            self.beam = self.Beam(level, pos, norm_vector=vec, charged=charged,
+                                  retain=(lambda: self.cast_this_tick))
+            level.sprites.append(self.beam)
+        else:
+            self.beam.aim(pos, vec, charged)
         self.last_tick_cast = self.player.game.ticks
-        self.last_vec = vec
-        self.last_pos = pos
-        self.last_col = col
-        self.last_charged = self.stationary_time >= 60
-
-    def destroy_beams(self):
-        for b in self.beams:
-            if not b.destroyed:
-                b.destroy()
-        self.beams.clear()
-
-    def repopulate_beams(self):
-        level = self.player.level
-        vec = self.player.best_heading_vector
-        pos = self.player.rect.center      
-        i = 0
-        added = []
-        hit = []
-        stop_on_next = False
-        first_collide = False
-        while not stop_on_next:
-            p = self.BeamProjectile(level, pos, norm_vector=vec, charged=self.stationary_time >= 60,
-                                    retain=(lambda: self.cast_this_tick))
-            for v in range(i):
-                p.xbuf += p.velx
-                p.ybuf += p.vely
-            p.rect.x, p.rect.y = p.xbuf, p.ybuf
-            if not p.inside_level:
-                break
-            if p.get_collision_nearby():
-                p.reason = projectiles.DestroyReason.Collision
-                stop_on_next = True
-            for sprite in p.get_local_enemy_sprites():
-                if sprite in hit:
-                    continue
-                if p.rect.colliderect(sprite.rect):
-                    p.last_attacked_sprite = sprite
-                    p.reason = projectiles.DestroyReason.DamageDeal
-                    hit.append(sprite)
-                    sprite.take_damage(p.damage)
-                    if not p.charged or len(hit) >= 3:
-                        stop_on_next = True
-                        break
-            for sprite in self.beams:
-                if p.rect.colliderect(sprite.rect):
-                    if i == 0:
-                        first_collide = True
-                    stop_on_next = True
-                    break
-            if first_collide:
-                break
-            added.append(p)
-            i += 1
-        for a in added:
-            a.moving = False
-            level.sprites.append(a)
-            self.beams.append(a)
 
 register = utils.Register.gather_type(AbstractSpell, locals())
 del register["ChanneledSpell"]
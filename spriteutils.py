@@ -1,17 +1,20 @@
+from levelgrid import tile_size, tile_rect_collides
+
 print("Load sprite utilities")
 
 def rect_cmove(rect, x, y, screen_rect):
     return rect.move(x, y).clamp(screen_rect)
 
-def level_impassable_collision(layout, rect, col, row):
-    if layout[row][col].passable: 
+# These take the level's passability grid (levelgrid.TileGrid)
+def level_impassable_collision(grid, rect, col, row):
+    if grid.data[row * grid.width + col]:
         return False
     else:
-        return rect.colliderect(layout[row][col].rect)
+        return tile_rect_collides(rect, col, row)
 
 imp_col = level_impassable_collision
 
-def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, noclip=False):
+def move_in_level(grid, moving, row, col, rect, move_speed, screen_rect, noclip=False):
     # This function only allows moving in a square-based grid, but it is pixel-perfect.
     # Unless player move speed is higher than a tile's size, this shouldn't cause
     # a crash. Otherwise, bad things may happen.
@@ -22,7 +25,7 @@ def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, nocli
         if moving["up"]:    rect.y -= move_speed
         if moving["down"]:  rect.y += move_speed
         return rect, []
-    level_cols, level_rows = len(layout[0]), len(layout)
+    level_cols, level_rows = grid.width, grid.height
     lft_in = col > 0; rgt_in = col + 1 < level_cols
     top_in = row > 0; bot_in = row + 1 < level_rows
     collides = []
@@ -32,11 +35,11 @@ def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, nocli
     if moving["left"]:
         next_rect = rect_cmove(rect, -move_speed, 0, screen_rect)
         collided = False
-        if lft_in and (imp_col(layout, next_rect, col - 1, row) or \
-           (top_in and imp_col(layout, next_rect, col - 1, row - 1)) or \
-           (bot_in and imp_col(layout, next_rect, col - 1, row + 1))):
+        if lft_in and (imp_col(grid, next_rect, col - 1, row) or \
+           (top_in and imp_col(grid, next_rect, col - 1, row - 1)) or \
+           (bot_in and imp_col(grid, next_rect, col - 1, row + 1))):
             collided = True
-            rect.left = layout[row][col - 1].rect.right
+            rect.left = col * tile_size
             collides.append("left")
         if not collided:
             rect = next_rect
@@ -44,11 +47,11 @@ def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, nocli
     if moving["right"]:
         next_rect = rect_cmove(rect, move_speed, 0, screen_rect)
         collided = False
-        if rgt_in and (imp_col(layout, next_rect, col + 1, row) or \
-           (top_in and imp_col(layout, next_rect, col + 1, row - 1)) or \
-           (bot_in and imp_col(layout, next_rect, col + 1, row + 1))):
+        if rgt_in and (imp_col(grid, next_rect, col + 1, row) or \
+           (top_in and imp_col(grid, next_rect, col + 1, row - 1)) or \
+           (bot_in and imp_col(grid, next_rect, col + 1, row + 1))):
             collided = True
-            rect.right = layout[row][col + 1].rect.left
+            rect.right = (col + 1) * tile_size
             collides.append("right")
         if not collided:
             rect = next_rect
@@ -56,11 +59,11 @@ def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, nocli
     if moving["up"]:
         next_rect = rect_cmove(rect, 0, -move_speed, screen_rect)
         collided = False
-        if top_in and (imp_col(layout, next_rect, col, row - 1) or \
-           (lft_in and imp_col(layout, next_rect, col - 1, row - 1)) or \
-           (rgt_in and imp_col(layout, next_rect, col + 1, row - 1))):
+        if top_in and (imp_col(grid, next_rect, col, row - 1) or \
+           (lft_in and imp_col(grid, next_rect, col - 1, row - 1)) or \
+           (rgt_in and imp_col(grid, next_rect, col + 1, row - 1))):
             collided = True
-            rect.top = layout[row - 1][col].rect.bottom
+            rect.top = row * tile_size
             collides.append("up")
         if not collided:
             rect = next_rect
@@ -68,11 +71,11 @@ def move_in_level(layout, moving, row, col, rect, move_speed, screen_rect, nocli
     if moving["down"]:
         next_rect = rect_cmove(rect, 0, move_speed, screen_rect)
         collided = False
-        if bot_in and (imp_col(layout, next_rect, col, row + 1) or \
-           (lft_in and imp_col(layout, next_rect, col - 1, row + 1)) or \
-           (rgt_in and imp_col(layout, next_rect, col + 1, row + 1))):
+        if bot_in and (imp_col(grid, next_rect, col, row + 1) or \
+           (lft_in and imp_col(grid, next_rect, col - 1, row + 1)) or \
+           (rgt_in and imp_col(grid, next_rect, col + 1, row + 1))):
             collided = True
-            rect.bottom = layout[row + 1][col].rect.top
+            rect.bottom = (row + 1) * tile_size
             collides.append("down")
         if not collided:
             rect = next_rect
@@ -10,6 +10,7 @@ import fontutils
 import imglib
 from abc_state import AbstractGameState
 import levels
+import prefetch
 from colors import Color
 import easing
 import spells
@@ -89,7 +90,7 @@ class UISlider:
 
     def update(self):
         for rect, args in zip(self.rects, self.args):
-            rect.x = self.ease(self.tick, *args)
+            rect.x = easing.ease_from_table(self.ease, self.tick, *args)
         self.tick += 1
         if self.tick > self.length:
             self.done = True       
@@ -533,10 +534,22 @@ class DungeonState(AbstractGameState):
     config = json.loadf("configs/dungeon.json")
     tile_size = config["tile_size"]
     pos_fix = config["level_surface_position"]
+    level_rect = pygame.Rect(config["level_surface_position"], config["level_surface_size"])
+    topbar_rect = pygame.Rect(config["topbar_position"], config["topbar_size"])
     config_ui = json.loadf("configs/playerui.json")
+    # With dirty rects (game.vars["dirty_rects"]), a frame with more
+    # rects drawn than this is followed by a complete one
+    max_dirty_rects = 200
     def __init__(self, game, *, level, entry_dir="any", player=None, repos_player=True):
         super().__init__(game)
 
+        # Dirty rects: the level render is restored only under the rects
+        # drawn over it during the last frame (None when it has to be drawn whole)
+        self.drawn_rects = None
+        self.invalidated_rects = []
+        self.last_screen = None
+        self.dirty_rects_count = 0 # Returned by the last draw, for debugging
+
         self.player = player
         self.player.parent_state = self
         self.player.level = level
@@ -553,6 +566,9 @@ class DungeonState(AbstractGameState):
 
         self.queue_state = None # Set to push a new state (if none other are pushed)
 
+        # Rooms behind the door next to the player, built ahead of time
+        self.prefetcher = prefetch.RoomPrefetcher(self)
+
         if repos_player:
             if self.level.start_entries[entry_dir] is not None:
                 entry_dir_pos = self.level.start_entries[entry_dir]
@@ -608,9 +624,21 @@ class DungeonState(AbstractGameState):
         if self.player.going_through_door:
             self.player.going_through_door = False
             self.handle_level_travel()
+        else:
+            self.prefetcher.update()
+            if self.game.vars["offscreen_simulation"]:
+                self.game.offscreen.update()
         self.game.ticks += 1
 
+    def resume(self):
+        super().resume()
+        # Other states have drawn over the screen
+        self.drawn_rects = None
+
     def draw(self, screen, *, dlevel=True, dplayer=True, dui=True, dborder=True):
+        if dlevel and self.game.vars["dirty_rects"]:
+            return self.draw_dirty(screen, dplayer=dplayer, dui=dui, dborder=dborder)
+        self.drawn_rects = None
         if dlevel:      
             self.level.draw(screen, self.pos_fix)
         if dplayer and not self.last_draw:     
@@ -622,6 +650,49 @@ class DungeonState(AbstractGameState):
         if self.last_draw:
             self.last_draw = False
 
+    def draw_dirty(self, screen, *, dplayer=True, dui=True, dborder=True):
+        level = self.level
+        last_render = level.current_render
+        level.prepare_render()
+        # The player's FOV covers the level every frame
+        complete = self.drawn_rects is None or screen is not self.last_screen or \
+                   level.current_render is not last_render or self.player.fov_enabled
+        restored = [] if complete else self.drawn_rects + self.invalidated_rects
+        if complete:
+            screen.blit(level.current_render, self.pos_fix)
+        else:
+            for rect in restored:
+                screen.blit(level.current_render, rect, rect.move(-self.pos_fix[0], -self.pos_fix[1]))
+        # Sprites are all drawn again, parts of them may have been restored over
+        recorder = imglib.DrawRecorder(screen)
+        level.draw_sprites(recorder, self.pos_fix)
+        if dplayer and not self.last_draw:
+            self.player.draw(recorder, self.pos_fix)
+        drawn = [rect.clip(self.level_rect) for rect in recorder.rects]
+        drawn = [rect for rect in drawn if rect]
+        if dui:
+            self.player.draw_ui(screen, self.pos_fix)
+        if dborder:
+            self.border_drawer.draw(screen, TOPLEFT)
+        if self.last_draw:
+            self.last_draw = False
+        self.last_screen = screen
+        self.invalidated_rects = []
+        self.drawn_rects = drawn if len(drawn) <= self.max_dirty_rects else None
+        if complete:
+            self.dirty_rects_count = 0
+            return None
+        rects = restored + drawn
+        if dui:
+            rects.append(self.topbar_rect)
+        self.dirty_rects_count = len(rects)
+        return rects
+
+    def invalidate_rect(self, rect):
+        rect = rect.clip(self.level_rect)
+        if rect:
+            self.invalidated_rects.append(rect)
+
     def handle_level_travel(self):
         # Through which door is the player going
         passage = self.player.near_passage 
@@ -648,7 +719,14 @@ class DungeonState(AbstractGameState):
         self.game.vars["player_mazepos"] = (next_x, next_y)
         if newlevelcls is None:
             newlevelcls = levels.EmptyLevel
-        if (next_x, next_y) in self.game.vars["level_caches"]:
+        self.game.offscreen.merge((next_x, next_y))
+        room = self.prefetcher.take((next_x, next_y))
+        self.prefetcher.clear()
+        if room is not None and room.level_cls is newlevelcls and \
+          room.cache is self.game.vars["level_caches"].get((next_x, next_y)):
+            cache = room.cache
+            newlevelobj = room.finish()
+        elif (next_x, next_y) in self.game.vars["level_caches"]:
             cache = self.game.vars["level_caches"][(next_x, next_y)]
             print("Next level's cache:\n{}".format(cache))
             newlevelobj = newlevelcls.load_from_cache(cache)
@@ -658,8 +736,7 @@ class DungeonState(AbstractGameState):
         new_state = DungeonState(self.game, level=newlevelobj, entry_dir=entry_dir, 
                                  player=self.player)
         if use_time_pass and cache is not None:
-            for i in range(min(1000, self.game.ticks - cache["last_tick"])):
-                new_state.level.update()
+            new_state.level.fast_forward(min(1000, self.game.ticks - cache["last_tick"]))
         if use_interlude:
             interlude = InterludeState.from_dungeon_states(self, new_state, door_dir)
             
@@ -775,7 +852,7 @@ class InterludeState(AbstractGameState):
 
     def update(self):
         self.tick += 1
-        v = easing.ease_in_out_cubic(self.tick, *self.ease_args)
+        v = easing.ease_from_table(easing.ease_in_out_cubic, self.tick, *self.ease_args)
         if self.way == "left":
             self.rect.x = -v
         elif self.way == "right":
@@ -1111,6 +1188,7 @@ class MinimapViewState(AbstractGameState):
     scroll_speed_max = 10
     scroll_speed_acc = 0.05
     ease_to_player_length = 100
+    crosshair = imglib.load_image_from_file("images/sl/ui/Crosshair.png", after_scale=(9, 9))
     def __init__(self, game, *, parent_surface=None):
         super().__init__(game)
 
@@ -1148,6 +1226,9 @@ class MinimapViewState(AbstractGameState):
             self.ease_tp = self.ease_tp_tick = self.ease_tp_args_x = self.ease_tp_args_y = None
             self.camera = None
         self.set_new_view_cage()
+        # Auto travel targets are picked with the crosshair, or the mouse
+        self.crosshair_rect = self.crosshair.get_rect()
+        self.crosshair_rect.center = self.view_cage_rect.center
 
         self.leaving = False
 
@@ -1160,6 +1241,10 @@ class MinimapViewState(AbstractGameState):
                 if self.scrolling and event.key == controls.MenuKeys.MinimapView_MoveToPlayer:
                     self.set_ease_to_player()
                     scrolled = True
+                if event.key == controls.MenuKeys.Action1:
+                    self.travel_to(self.crosshair_rect.center)
+            if self.game.use_mouse and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                self.travel_to(event.pos)
         if self.scrolling:
             scrolled_m = self.camera.handle_moving(pressed_keys, mouse_pos, self.game.use_mouse)
             scrolled = scrolled or scrolled_m
@@ -1174,8 +1259,9 @@ class MinimapViewState(AbstractGameState):
             self.cleanup()
             return
         if self.ease_tp:
-            self.view_rect.centerx = easing.ease_in_out_cubic(self.ease_tp_tick, *self.ease_tp_args_x)
-            self.view_rect.centery = easing.ease_in_out_cubic(self.ease_tp_tick, *self.ease_tp_args_y)
+            ease = easing.ease_from_table
+            self.view_rect.centerx = ease(easing.ease_in_out_cubic, self.ease_tp_tick, *self.ease_tp_args_x)
+            self.view_rect.centery = ease(easing.ease_in_out_cubic, self.ease_tp_tick, *self.ease_tp_args_y)
             self.xbuf, self.ybuf = self.view_rect.topleft
             self.ease_tp_tick += 1
             self.set_new_view_cage()
@@ -1185,6 +1271,36 @@ class MinimapViewState(AbstractGameState):
     def draw(self, screen):
         screen.blit(self.background, TOPLEFT)
         screen.blit(self.view_cage, self.view_cage_rect)
+        if not self.game.use_mouse:
+            screen.blit(self.crosshair, self.crosshair_rect)
+
+    def get_maze_position(self, screen_pos):
+        # Maze cell shown at a position on the screen, or None
+        if not self.view_cage_rect.collidepoint(screen_pos):
+            return None
+        x = screen_pos[0] - self.view_cage_rect.x
+        y = screen_pos[1] - self.view_cage_rect.y
+        if self.scrolling:
+            x, y = x + self.view_rect.x, y + self.view_rect.y
+        else:
+            x, y = x - self.view_rect.x, y - self.view_rect.y
+        tile = self.minimap.minimap_tile
+        col, row = int(x // tile), int(y // tile)
+        width, height = self.game.vars["mapsize"]
+        if 0 <= col < width and 0 <= row < height:
+            return col, row
+        return None
+
+    def travel_to(self, screen_pos):
+        # Only to rooms the player has seen on the minimap
+        mazepos = self.get_maze_position(screen_pos)
+        if mazepos is None or mazepos == self.game.vars["player_mazepos"]:
+            return
+        col, row = mazepos
+        if not self.player.map_reveal[row][col] or self.game.vars["map"][row][col] is None:
+            return
+        if self.player.start_auto_travel(mazepos):
+            self.leaving = True
 
     def get_player_minimap_center_position(self):
         mazepos = self.game.vars["player_mazepos"]
@@ -39,6 +39,25 @@ class StatusEffects:
                 effect.on_end()
                 self.effects.remove(effect)   
 
+    def fast_forward(self, ticks, tick=None):
+        # The last ticks were skipped: their effects are applied at once
+        # (without particles), and the effects that ran out meanwhile end
+        if tick is None: tick = self.get_tick()
+        for effect in self.effects.copy():
+            active = ticks
+            if effect.ends_on is not None:
+                active = max(0, min(ticks, effect.ends_on - (tick - ticks)))
+            effect.fast_forward(active)
+            if effect.ends_on is not None and tick >= effect.ends_on:
+                effect.on_end()
+                self.effects.remove(effect)
+
+    def apply_modifiers(self):
+        # The part of update that changes attributes, without anything per tick
+        for effect in self.effects:
+            if effect.move_speed_mul is not None:
+                self.parent.move_speed *= effect.move_speed_mul
+
     def has(self, cls):
         search = [e for e in self.effects if isinstance(e, cls)]
         return search[0] if search else None
@@ -108,6 +127,10 @@ class BaseStatusEffect:
     def update(self):
         pass
 
+    def fast_forward(self, ticks):
+        if self.damage_per_tick is not None:
+            self.parent.take_damage(self.damage_per_tick * ticks)
+
     def spawn_particle(self):
         new = particles.Particle.from_sprite
         p = new(self.parent, 4, utils.Vector.uniform(self.particle_speed),
@@ -163,4 +186,7 @@ class Regeneration(BaseStatusEffect):
         super().update()
         self.parent.heal(self.heal_per_tick)
 
+    def fast_forward(self, ticks):
+        self.parent.heal(self.heal_per_tick * ticks)
+
 register = utils.Register.gather_type(BaseStatusEffect, locals())
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Compares pathfinding.a_star_in_level with pathfinding.PathGrid
+# (A* and jump point search) on every level in levels/.
+# Run from the util directory: python benchmark_pathfinding.py [pairs per level]
+
+import os
+import random
+import sys
+import time
+
+os.chdir("..")
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+pygame.display.init()
+pygame.display.set_mode((1, 1))
+
+import levels
+import pathfinding
+
+def is_valid(path, grid):
+    for (c1, r1), (c2, r2) in zip(path, path[1:]):
+        if (c1, r1) not in pathfinding.tile_neighbours_in_level(c2, r2, grid):
+            return False
+    return True
+
+def timed(function, pairs):
+    start = time.perf_counter()
+    result = [function(a, b) for a, b in pairs]
+    return result, time.perf_counter() - start
+
+def main(count=200, seed=0):
+    random.seed(seed)
+    totals = {"a_star_in_level": 0, "PathGrid": 0, "PathGrid (JPS)": 0}
+    print("{:<24} {:>10} {:>10} {:>10}".format("level", *totals))
+    for level_cls in levels.all_levels:
+        grid = level_cls.get_layout_template().passable_grid
+        tiles = [(col, row) for row in range(grid.height) for col in range(grid.width) if grid.get(col, row)]
+        pairs = [(random.choice(tiles), random.choice(tiles)) for _ in range(count)]
+        path_grid = pathfinding.PathGrid(grid)
+        results = {}
+        times = {}
+        results["a_star_in_level"], times["a_star_in_level"] = \
+            timed(lambda a, b: pathfinding.a_star_in_level(a, b, grid), pairs)
+        results["PathGrid"], times["PathGrid"] = timed(path_grid.find_path, pairs)
+        results["PathGrid (JPS)"], times["PathGrid (JPS)"] = \
+            timed(lambda a, b: path_grid.find_path(a, b, jps=True), pairs)
+        expected = results["a_star_in_level"]
+        for name, paths in results.items():
+            for (a, b), path, reference in zip(pairs, paths, expected):
+                same_length = abs(pathfinding.path_length(path) - pathfinding.path_length(reference)) < 1e-6
+                assert bool(path) == bool(reference) and same_length, (name, level_cls.__name__, a, b)
+                assert not path or (path[0] == b and path[-1] == a and is_valid(path, grid)), (name, a, b)
+            totals[name] += times[name]
+        print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            level_cls.__name__, *(times[name] * 1000 for name in totals)))
+    print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format("total (ms)", *(t * 1000 for t in totals.values())))
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,95 @@
+# Time of re-entering a cached room that missed 1000 ticks: with every tick
+# run by BaseLevel.update (the old behaviour) and with BaseLevel.fast_forward.
+# Both should leave the same enemies with the same health points, and move
+# about as many of them (the random wandering differs between the two).
+# Run from the util directory: python benchmark_transitions.py [rooms] [enemies per room]
+
+import os
+import random
+import sys
+import time
+
+os.chdir("..")
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import app
+import enemies
+import levels
+import states
+import statuseffects
+
+missed_ticks = 1000
+
+def populate(level, count):
+    grid = level.passable_grid
+    tiles = [(col, row) for row in range(grid.height) for col in range(grid.width) if grid.get(col, row)]
+    for i in range(count):
+        col, row = random.choice(tiles)
+        enemy_cls = enemies.GrayGoo if i % 3 else enemies.SkeletonArcher
+        enemy = enemy_cls(level, level.layout[row][col])
+        if not i % 4:
+            ticks = level.parent.game.ticks
+            enemy.status_effects.add(statuseffects.Burning(enemy, ticks, random.randint(100, 2000)))
+        level.sprites.append(enemy)
+
+def enter(game, level_cls, cache, catch_up):
+    start = time.perf_counter()
+    level = level_cls.load_from_cache(cache)
+    state = states.DungeonState(game, level=level, player=game.player)
+    catch_up(state.level)
+    return time.perf_counter() - start, state.level
+
+def run_ticks(level):
+    for _ in range(missed_ticks):
+        level.update()
+
+def fast_forward(level):
+    level.fast_forward(missed_ticks)
+
+def summary(level, cache):
+    # Enemies left, their health points and how many of them moved
+    hostile = level.hostile_sprites
+    cached_positions = {tuple(sprite["pos"]) for sprite in cache["sprites"] if sprite["type"] == "enemy"}
+    moved = sum(1 for sprite in hostile if sprite.rect.topleft not in cached_positions)
+    return len(hostile), round(sum(sprite.health_points for sprite in hostile), 1), moved
+
+def main(rooms=20, count=30, seed=0):
+    random.seed(seed)
+    game = app.App(app.screen).game
+    game.new_game()
+    game.player.take_damage = lambda *args, **kwargs: None
+    level_classes = random.sample(levels.all_gen_levels, min(rooms, len(levels.all_gen_levels)))
+    totals = {"update": 0, "fast_forward": 0}
+    mismatches = []
+    print("{:<24} {:>10} {:>14} {:>10} {:>14} {:>14}".format(
+          "level", "update", "fast_forward", "before", "after", "after (ff)"))
+    for level_cls in level_classes:
+        state = states.DungeonState(game, level=level_cls(), player=game.player)
+        populate(state.level, count)
+        for _ in range(50):
+            state.level.update()
+        cache = state.level.create_cache()
+        before = summary(state.level, cache)
+        game.ticks += missed_ticks
+        results = {}
+        for name, catch_up in (("update", run_ticks), ("fast_forward", fast_forward)):
+            random.seed(seed)
+            elapsed, level = enter(game, level_cls, cache, catch_up)
+            totals[name] += elapsed
+            results[name] = (elapsed, summary(level, cache))
+        # Enemies left/their health points, then /how many moved
+        updated, forwarded = results["update"][1], results["fast_forward"][1]
+        print("{:<24} {:>10.1f} {:>14.1f} {:>10} {:>14} {:>14}".format(
+              level_cls.__name__, results["update"][0] * 1000, results["fast_forward"][0] * 1000,
+              "{}/{}".format(*before[:2]), "{}/{}/{}".format(*updated), "{}/{}/{}".format(*forwarded)))
+        # Enemies that move when every tick is run have to move when fast-forwarded too
+        if updated[:2] != forwarded[:2] or forwarded[2] < updated[2] // 2:
+            mismatches.append(level_cls.__name__)
+    print("{:<24} {:>10.1f} {:>14.1f}".format("total (ms)", *(t * 1000 for t in totals.values())))
+    if mismatches:
+        print("fast_forward differs from update in:", ", ".join(mismatches))
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))